@@ -1,19 +1,21 @@
+import importlib
 import os
 import sys
 import threading
-import json
-import re
-import glob
+import queue
 import subprocess
+import multiprocessing
 import tkinter.messagebox
 import customtkinter as ctk
 from customtkinter import filedialog
-import requests
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-from mutagen.mp3 import MP3
-from mutagen.id3 import ID3, APIC, TIT2, TPE1, TALB, TDRC, TRCK, TPOS
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import default_config_path, cache_path_for, download_index_path_for, library_index_path_for, load_config, save_config
+from media import find_ffmpeg
+from pipeline import first_line, format_stats
+
+# The engine, the SQLite stores and the libraries behind them (spotipy,
+# yt-dlp, mutagen) are imported on first use, or by warm_up() after the
+# window is shown, so they do not delay the first paint. See
+# benchmarks/bench_startup.py.
 
 def resource_path(relative_path):
     try:
@@ -22,30 +24,121 @@ def resource_path(relative_path):
         base_path = os.path.abspath(".")
     return os.path.join(base_path, relative_path)
 
+class LibraryList(ctk.CTkFrame):
+    # Only the rows that fit on screen exist as widgets; scrolling re-binds
+    # them to a different slice of self.items.
+    ROW_HEIGHT = 36
+
+    def __init__(self, master, on_play, on_show, button_style, **kwargs):
+        super().__init__(master, **kwargs)
+        self.on_play = on_play
+        self.on_show = on_show
+        self.button_style = button_style
+        self.items = []
+        self.rows = []
+        self.first = 0
+
+        self.rows_frame = ctk.CTkFrame(self, fg_color="transparent")
+        self.rows_frame.pack(side="left", expand=True, fill="both")
+        self.scrollbar = ctk.CTkScrollbar(self, command=self.on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y")
+
+        self.rows_frame.bind("<Configure>", self.on_resize)
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.bind_all(sequence, self.on_mousewheel, add="+")
+
+    def set_items(self, items, keep_position=False):
+        self.items = items
+        self.scroll_to(self.first if keep_position else 0)
+
+    def make_row(self):
+        row = {'path': None}
+        row['frame'] = ctk.CTkFrame(self.rows_frame, height=self.ROW_HEIGHT - 4)
+        row['label'] = ctk.CTkLabel(row['frame'], text="", anchor="w")
+        row['label'].pack(side="left", expand=True, fill="x", padx=5)
+        show_button = ctk.CTkButton(row['frame'], text="Folder", width=60, command=lambda: self.on_show(row['path']), **self.button_style)
+        show_button.pack(side="right", padx=2)
+        play_button = ctk.CTkButton(row['frame'], text="Play", width=50, command=lambda: self.on_play(row['path']), **self.button_style)
+        play_button.pack(side="right", padx=2)
+        return row
+
+    def on_resize(self, event):
+        visible = max(1, event.height // self.ROW_HEIGHT)
+        while len(self.rows) < visible:
+            self.rows.append(self.make_row())
+        while len(self.rows) > visible:
+            self.rows.pop()['frame'].destroy()
+        self.scroll_to(self.first)
+
+    def scroll_to(self, first):
+        self.first = max(0, min(int(first), len(self.items) - len(self.rows)))
+        for i, row in enumerate(self.rows):
+            index = self.first + i
+            if index < len(self.items):
+                item = self.items[index]
+                row['path'] = item['path']
+                row['label'].configure(text=item['filename'])
+                row['frame'].place(x=0, y=i * self.ROW_HEIGHT + 2, relwidth=1)
+            else:
+                row['path'] = None
+                row['frame'].place_forget()
+        if self.items:
+            self.scrollbar.set(self.first / len(self.items), min(1.0, (self.first + len(self.rows)) / len(self.items)))
+        else:
+            self.scrollbar.set(0, 1)
+
+    def on_scrollbar(self, action, value, units=None):
+        if action == "moveto":
+            self.scroll_to(float(value) * len(self.items))
+        elif action == "scroll":
+            step = len(self.rows) if units == "pages" else 1
+            self.scroll_to(self.first + int(value) * step)
+
+    def on_mousewheel(self, event):
+        widget_path, own_path = str(event.widget), str(self)
+        if widget_path != own_path and not widget_path.startswith(own_path + "."):
+            return
+        if event.num == 4:
+            delta = -3
+        elif event.num == 5:
+            delta = 3
+        else:
+            delta = -3 if event.delta > 0 else 3
+        self.scroll_to(self.first + delta)
+
 class App(ctk.CTk):
+    UI_POLL_MS = 100
+    LOG_MAX_LINES = 1000
+    # opus and m4a keep YouTube's audio as-is when possible instead of re-encoding.
+    OUTPUT_FORMAT_CHOICES = ["mp3", "opus", "m4a", "mp3,opus", "mp3,m4a"]
+
     def __init__(self):
         super().__init__()
 
-        if getattr(sys, 'frozen', False):
-            application_path = os.path.dirname(sys.executable)
-            self.CONFIG_FILE = os.path.join(application_path, "config.json")
-        else:
-            self.CONFIG_FILE = "config.json"
+        self.CONFIG_FILE = default_config_path()
             
         self.download_path = ctk.StringVar(value="downloads")
         self.quality_var = ctk.StringVar(value="320")
+        self.output_format_var = ctk.StringVar(value="mp3")
         self.theme_var = ctk.StringVar(value="dark")
         self.client_id_var = ctk.StringVar()
         self.client_secret_var = ctk.StringVar()
         self.duplicate_handling_var = ctk.StringVar(value="skip")
+        self.settings = {}
         
-        self.sp = None
+        self.engine = None
         self.successful_downloads = []
         self.failed_downloads = []
 
         self.is_paused = threading.Event()
         self.is_stopped = threading.Event()
         self.download_thread = None
+        self.library_index = None
+        self.download_index = None
+        self.cache = None
+        self.library_scan_thread = None
+        self.library_filter_job = None
+        self.ui_queue = queue.Queue()
 
         self.load_settings()
         
@@ -56,7 +149,37 @@ class App(ctk.CTk):
 
         self.create_widgets()
         self.protocol("WM_DELETE_WINDOW", self.on_closing)
-        self.after(100, self.refresh_library)
+        self.after(self.UI_POLL_MS, self.process_ui_queue)
+        self.after(100, self.after_first_paint)
+
+    def after_first_paint(self):
+        self.refresh_library()
+        threading.Thread(target=self.warm_up, daemon=True).start()
+
+    def warm_up(self):
+        # Off the UI thread: pre-import what the first download needs and
+        # check for FFmpeg without spawning it.
+        if find_ffmpeg() is None:
+            self.log_status("WARNING: FFmpeg not found! Download it from https://ffmpeg.org/download.html "
+                            "and add its 'bin' folder to your PATH, or downloads cannot be converted.")
+        importlib.import_module("engine")
+
+    def open_job_stores(self):
+        if self.cache is None:
+            from cache import MetadataCache
+            self.cache = MetadataCache(
+                cache_path_for(self.CONFIG_FILE),
+                ttl_seconds=self.settings["cache_ttl_hours"] * 3600,
+                max_bytes=self.settings["cache_max_mb"] * 1024 * 1024,
+            )
+        if self.download_index is None:
+            from dedup import DownloadIndex
+            self.download_index = DownloadIndex(download_index_path_for(self.CONFIG_FILE))
+
+    def close_stores(self):
+        for store in (self.cache, self.library_index, self.download_index):
+            if store is not None:
+                store.close()
 
     def get_button_style(self):
         return {"corner_radius": 0, "border_width": 2, "border_color": "#E0E0E0"}
@@ -95,6 +218,9 @@ class App(ctk.CTk):
         self.progress_bar.set(0)
         self.progress_bar.pack(pady=5, padx=10, fill="x")
 
+        self.pipeline_stats_label = ctk.CTkLabel(self.downloader_tab, text="", anchor="w")
+        self.pipeline_stats_label.pack(padx=10, fill="x")
+
         self.status_textbox = ctk.CTkTextbox(self.downloader_tab, state="disabled")
         self.status_textbox.pack(pady=10, padx=10, expand=True, fill="both")
 
@@ -104,10 +230,10 @@ class App(ctk.CTk):
         self.search_library_entry = ctk.CTkEntry(self.library_controls_frame, placeholder_text="Search Library...")
         self.search_library_entry.pack(side="left", expand=True, fill="x", padx=(0, 10))
         self.search_library_entry.bind("<KeyRelease>", self.filter_library)
-        self.refresh_library_button = ctk.CTkButton(self.library_controls_frame, text="Refresh", command=self.refresh_library, **self.get_button_style())
+        self.refresh_library_button = ctk.CTkButton(self.library_controls_frame, text="Refresh", command=lambda: self.refresh_library(force=True), **self.get_button_style())
         self.refresh_library_button.pack(side="left")
-        self.library_scrollable_frame = ctk.CTkScrollableFrame(self.library_tab)
-        self.library_scrollable_frame.pack(pady=10, padx=10, expand=True, fill="both")
+        self.library_list = LibraryList(self.library_tab, on_play=self.play_track, on_show=self.show_in_folder, button_style=self.get_button_style())
+        self.library_list.pack(pady=10, padx=10, expand=True, fill="both")
         
     def create_results_tab(self):
         self.summary_frame = ctk.CTkFrame(self.results_tab)
@@ -118,6 +244,10 @@ class App(ctk.CTk):
         self.summary_success_label.pack(side="left", expand=True)
         self.summary_failed_label = ctk.CTkLabel(self.summary_frame, text="Failed: 0")
         self.summary_failed_label.pack(side="left", expand=True)
+        self.retry_failed_button = ctk.CTkButton(self.summary_frame, text="Retry Failed", command=self.retry_failed_downloads, state="disabled", **self.get_button_style())
+        self.retry_failed_button.pack(side="left", padx=5, pady=5)
+        self.timing_label = ctk.CTkLabel(self.results_tab, text="", justify="left", anchor="w")
+        self.timing_label.pack(padx=10, fill="x")
         self.failed_list_label = ctk.CTkLabel(self.results_tab, text="Failed Downloads:")
         self.failed_list_label.pack(pady=(10,0), padx=10, anchor="w")
         self.failed_scrollable_frame = ctk.CTkScrollableFrame(self.results_tab)
@@ -162,6 +292,10 @@ class App(ctk.CTk):
         self.quality_label.pack(side="left", padx=(10, 5), pady=10)
         self.quality_menu = ctk.CTkOptionMenu(self.appearance_frame, values=["128", "192", "256", "320"], variable=self.quality_var, corner_radius=0)
         self.quality_menu.pack(side="left", padx=5, pady=10)
+        self.output_format_label = ctk.CTkLabel(self.appearance_frame, text="Format:")
+        self.output_format_label.pack(side="left", padx=(20, 5), pady=10)
+        self.output_format_menu = ctk.CTkOptionMenu(self.appearance_frame, values=self.OUTPUT_FORMAT_CHOICES, variable=self.output_format_var, corner_radius=0)
+        self.output_format_menu.pack(side="left", padx=5, pady=10)
         self.theme_label = ctk.CTkLabel(self.appearance_frame, text="Theme:")
         self.theme_label.pack(side="left", padx=(20, 5), pady=10)
         self.theme_switch = ctk.CTkSwitch(self.appearance_frame, text="Light Mode", command=self.toggle_theme)
@@ -172,34 +306,33 @@ class App(ctk.CTk):
         self.save_settings_button = ctk.CTkButton(self.settings_scrollable_frame, text="Save All Settings", command=self.save_settings, **self.get_button_style())
         self.save_settings_button.pack(pady=20, padx=10)
 
-    def sanitize_filename(self, filename):
-        return "".join(c for c in filename if c not in r'\/:*?"<>|')
-
     def load_settings(self):
-        try:
-            with open(self.CONFIG_FILE, 'r') as f:
-                config = json.load(f)
-                self.download_path.set(config.get("download_path", "downloads"))
-                self.quality_var.set(config.get("quality", "320"))
-                self.theme_var.set(config.get("theme", "dark"))
-                self.client_id_var.set(config.get("client_id", ""))
-                self.client_secret_var.set(config.get("client_secret", ""))
-                self.duplicate_handling_var.set(config.get("duplicate_handling", "skip"))
-        except (FileNotFoundError, json.JSONDecodeError):
-            if not os.path.exists("downloads"):
-                os.makedirs("downloads")
+        if not os.path.exists(self.CONFIG_FILE) and not os.path.exists("downloads"):
+            os.makedirs("downloads")
+        self.settings = load_config(self.CONFIG_FILE)
+        self.download_path.set(self.settings["download_path"])
+        self.quality_var.set(self.settings["quality"])
+        self.output_format_var.set(self.settings["output_format"])
+        self.theme_var.set(self.settings["theme"])
+        self.client_id_var.set(self.settings["client_id"])
+        self.client_secret_var.set(self.settings["client_secret"])
+        self.duplicate_handling_var.set(self.settings["duplicate_handling"])
+
+    def current_settings(self):
+        return dict(
+            self.settings,
+            download_path=self.download_path.get(),
+            quality=self.quality_var.get(),
+            output_format=self.output_format_var.get(),
+            theme=self.theme_var.get(),
+            client_id=self.client_id_var.get(),
+            client_secret=self.client_secret_var.get(),
+            duplicate_handling=self.duplicate_handling_var.get(),
+        )
 
     def save_settings(self):
-        config = {
-            "download_path": self.download_path.get(),
-            "quality": self.quality_var.get(),
-            "theme": self.theme_var.get(),
-            "client_id": self.client_id_var.get(),
-            "client_secret": self.client_secret_var.get(),
-            "duplicate_handling": self.duplicate_handling_var.get()
-        }
-        with open(self.CONFIG_FILE, 'w') as f:
-            json.dump(config, f, indent=4)
+        self.settings = self.current_settings()
+        save_config(self.CONFIG_FILE, self.settings)
         self.log_status("Settings saved.")
             
     def on_closing(self):
@@ -207,28 +340,15 @@ class App(ctk.CTk):
             if tkinter.messagebox.askyesno("Confirm Exit", "A download is in progress. Are you sure you want to exit?"):
                 self.stop_download()
                 self.download_thread.join()
+                self.close_stores()
                 self.destroy()
         else:
             self.save_settings()
+            if self.library_scan_thread and self.library_scan_thread.is_alive():
+                self.library_scan_thread.join()
+            self.close_stores()
             self.destroy()
         
-    def initialize_spotify(self):
-        client_id, client_secret = self.client_id_var.get(), self.client_secret_var.get()
-        if not client_id or not client_secret:
-            tkinter.messagebox.showerror("Missing Credentials", "Spotify Client ID and Secret are not set. Please set them in the Settings tab.")
-            self.tab_view.set("Settings")
-            return False
-        try:
-            auth_manager = SpotifyClientCredentials(client_id=client_id, client_secret=client_secret)
-            self.sp = spotipy.Spotify(auth_manager=auth_manager)
-            self.sp.search(q='test', type='track', limit=1)
-            return True
-        except Exception as e:
-            tkinter.messagebox.showerror("Spotify Error", f"Could not connect to Spotify. Check your credentials.\n\nError: {e}")
-            self.tab_view.set("Settings")
-            self.sp = None
-            return False
-
     def select_folder(self):
         path = filedialog.askdirectory(initialdir=self.download_path.get())
         if path:
@@ -240,22 +360,142 @@ class App(ctk.CTk):
         self.theme_var.set(mode)
             
     def log_status(self, message):
+        self.ui_queue.put(('log', str(message)))
+
+    def post_to_ui(self, func, *args):
+        self.ui_queue.put(('call', func, args))
+
+    def ask_on_ui(self, func, *args):
+        # For worker threads: runs func, e.g. a dialog, on the main loop and
+        # waits for its result.
+        result = {}
+        done = threading.Event()
+
+        def call():
+            try:
+                result['value'] = func(*args)
+            finally:
+                done.set()
+
+        self.post_to_ui(call)
+        # Stopping (e.g. closing the window) must not leave the thread waiting.
+        while not done.wait(0.1):
+            if self.is_stopped.is_set():
+                return None
+        return result.get('value')
+
+    def process_ui_queue(self):
+        # Worker threads never touch Tk directly; everything they report is
+        # applied here on the main loop, one batch per tick. Only the latest
+        # progress and stats values of a batch are drawn. Tk runs an after()
+        # callback once, so the next tick is scheduled whatever happens here.
+        try:
+            self.apply_ui_updates()
+        finally:
+            self.after(self.UI_POLL_MS, self.process_ui_queue)
+
+    def apply_ui_updates(self):
+        log_lines, calls = [], []
+        progress = stats = None
+        try:
+            for _ in range(5000):
+                item = self.ui_queue.get_nowait()
+                if item[0] == 'log':
+                    log_lines.append(item[1])
+                elif item[0] == 'progress':
+                    progress = item[1]
+                elif item[0] == 'stats':
+                    stats = item[1]
+                else:
+                    calls.append(item)
+        except queue.Empty:
+            pass
+
+        if log_lines:
+            self.append_log(log_lines[-self.LOG_MAX_LINES:])
+        if progress is not None:
+            self.progress_bar.set(progress)
+        if stats is not None:
+            self.pipeline_stats_label.configure(text=stats)
+        for _, func, args in calls:
+            try:
+                func(*args)
+            except Exception as e:
+                self.log_status(f"An error occurred: {e}")
+
+    def append_log(self, lines):
         self.status_textbox.configure(state="normal")
-        self.status_textbox.insert("end", str(message) + "\n")
+        self.status_textbox.insert("end", "\n".join(lines) + "\n")
+        line_count = int(self.status_textbox.index("end-1c").split(".")[0]) - 1
+        if line_count > self.LOG_MAX_LINES:
+            self.status_textbox.delete("1.0", f"{line_count - self.LOG_MAX_LINES + 1}.0")
         self.status_textbox.configure(state="disabled")
         self.status_textbox.see("end")
 
-    def parse_spotify_url(self, url):
-        match = re.search(r"spotify\.com/(playlist|album|track)/([a-zA-Z0-9]+)", url)
-        if match:
-            return match.groups()
-        return None, None
-        
-    def start_download_thread(self):
+    def can_start_job(self):
         if self.download_thread and self.download_thread.is_alive():
             self.log_status("A download is already in progress.")
+            return False
+
+        client_id, client_secret = self.client_id_var.get(), self.client_secret_var.get()
+        if not client_id or not client_secret:
+            tkinter.messagebox.showerror("Missing Credentials", "Spotify Client ID and Secret are not set. Please set them in the Settings tab.")
+            self.tab_view.set("Settings")
+            return False
+        return True
+
+    def create_engine(self):
+        from engine import DownloadEngine
+
+        self.open_job_stores()
+        return DownloadEngine(self.current_settings(), cache=self.cache, downloads=self.download_index, on_event=self.handle_engine_event,
+                              is_paused=self.is_paused, is_stopped=self.is_stopped)
+
+    def start_download_thread(self):
+        if not self.can_start_job():
             return
 
+        url = self.url_entry.get()
+        if not url:
+            self.log_status("Error: Please paste a Spotify URL.")
+            return
+
+        from engine import parse_spotify_url
+
+        url_type, url_id = parse_spotify_url(url)
+        if not url_type:
+            tkinter.messagebox.showwarning("Invalid URL", "The provided URL does not appear to be a valid Spotify Track, Album, or Playlist link.")
+            return
+
+        engine = self.create_engine()
+
+        def job():
+            # Reading the journal of a large job takes a while, so it is
+            # checked here on the download thread rather than on the UI.
+            status = engine.job_status()
+            if status and status['pending']:
+                answer = self.ask_on_ui(
+                    tkinter.messagebox.askyesnocancel, "Unfinished Download",
+                    f"The previous download was interrupted with {status['pending']} of {status['total']} track(s) left.\n\n"
+                    "Resume it instead of starting this download?",
+                )
+                if answer is None:
+                    return None
+                if answer:
+                    return engine.resume_job()
+            return engine.run([url])
+
+        self.start_job(engine, job)
+
+    def retry_failed_downloads(self):
+        if not self.can_start_job():
+            return
+        engine = self.create_engine()
+        self.tab_view.set("Downloader")
+        self.start_job(engine, lambda: engine.resume_job(pending=False, failed=True))
+
+    def start_job(self, engine, job):
+        self.engine = engine
         self.is_paused.clear()
         self.is_stopped.clear()
         
@@ -264,7 +504,7 @@ class App(ctk.CTk):
         self.stop_button.configure(state="normal")
         self.progress_bar.set(0)
         
-        self.download_thread = threading.Thread(target=self.run_download_job)
+        self.download_thread = threading.Thread(target=self.run_download_job, args=(job,))
         self.download_thread.start()
 
     def toggle_pause(self):
@@ -284,146 +524,48 @@ class App(ctk.CTk):
             if self.is_paused.is_set():
                 self.is_paused.clear()
 
-    def run_download_job(self):
-        if not self.initialize_spotify():
-            self.reset_ui_state()
-            return
-        
-        url = self.url_entry.get()
-        if not url:
-            self.log_status("Error: Please paste a Spotify URL.")
-            self.reset_ui_state()
-            return
-
-        url_type, url_id = self.parse_spotify_url(url)
-        if not url_type:
-            tkinter.messagebox.showwarning("Invalid URL", "The provided URL does not appear to be a valid Spotify Track, Album, or Playlist link.")
-            self.reset_ui_state()
+    def run_download_job(self, job):
+        try:
+            self.engine.connect()
+        except Exception as e:
+            self.post_to_ui(self.show_spotify_error, e)
+            self.post_to_ui(self.reset_ui_state)
             return
 
-        self.successful_downloads.clear()
-        self.failed_downloads.clear()
-        os.makedirs(self.download_path.get(), exist_ok=True)
-        
         try:
-            self.log_status(f"Fetching {url_type} information...")
-            tracks_to_process = []
-            if url_type == 'playlist':
-                results = self.sp.playlist_tracks(url_id)
-                items = results['items']
-                while results['next']:
-                    results = self.sp.next(results)
-                    items.extend(results['items'])
-                tracks_to_process = [item['track'] for item in items if item and item.get('track')]
-            elif url_type == 'album':
-                album_tracks = self.sp.album_tracks(url_id)['items']
-                album_details = self.sp.album(url_id)
-                for track_stub in album_tracks:
-                    full_track = self.sp.track(track_stub['id'])
-                    full_track['album'] = album_details
-                    tracks_to_process.append(full_track)
-            elif url_type == 'track':
-                track_data = self.sp.track(url_id)
-                tracks_to_process.append(track_data)
-
-            total_tracks = len(tracks_to_process)
-            self.log_status(f"Found {total_tracks} track(s). Starting parallel download...")
-
-            with ThreadPoolExecutor(max_workers=4) as executor:
-                futures = [executor.submit(self.download_single_track, track) for track in tracks_to_process]
-                
-                for i, future in enumerate(as_completed(futures)):
-                    if self.is_stopped.is_set():
-                        break
-                    try:
-                        result = future.result()
-                        if result['status'] == 'success':
-                            self.successful_downloads.append(result['name'])
-                        elif result['status'] == 'failure':
-                            self.failed_downloads.append(result['data'])
-                    except Exception as exc:
-                        self.log_status(f"A task generated an exception: {exc}")
-                    
-                    self.progress_bar.set((i + 1) / total_tracks)
-        
+            summary = job()
         except Exception as e:
+            # e.g. the download folder is missing, read-only or full.
             self.log_status(f"An error occurred: {e}")
+            summary = None
+        if summary is None:
+            self.post_to_ui(self.reset_ui_state)
+            return
+        self.post_to_ui(self.finish_download_job, summary)
+
+    def show_spotify_error(self, error):
+        tkinter.messagebox.showerror("Spotify Error", f"Could not connect to Spotify. Check your credentials.\n\nError: {error}")
+        self.tab_view.set("Settings")
 
-        self.update_results_tab(total_tracks)
+    def finish_download_job(self, summary):
+        self.successful_downloads = self.engine.successful_downloads
+        self.failed_downloads = self.engine.failed_downloads
+        self.update_results_tab(summary['total'])
         self.reset_ui_state()
         self.refresh_library()
 
-    def download_single_track(self, track_info):
-        import yt_dlp
-        
-        if self.is_stopped.is_set(): return {'status': 'stopped'}
-        if self.is_paused.is_set(): self.is_paused.wait()
-        if self.is_stopped.is_set(): return {'status': 'stopped'}
-
-        original_track_name, original_artist_name = "N/A", "N/A"
-        try:
-            if not track_info:
-                return {'status': 'failure', 'data': {'track': 'Unavailable', 'artist': '', 'reason': 'Track data is null.'}}
-
-            original_track_name = track_info['name']
-            original_artist_name = track_info['artists'][0]['name']
-            sanitized_track_name = self.sanitize_filename(original_track_name)
-            sanitized_artist_name = self.sanitize_filename(original_artist_name)
-            
-            final_filepath = os.path.join(self.download_path.get(), f"{sanitized_artist_name} - {sanitized_track_name}.mp3")
-            
-            if os.path.exists(final_filepath):
-                handling_mode = self.duplicate_handling_var.get()
-                if handling_mode == "skip":
-                    self.log_status(f"-> Skipping duplicate: {original_track_name}")
-                    return {'status': 'success', 'name': original_track_name}
-                elif handling_mode == "overwrite":
-                    self.log_status(f"-> Overwriting: {original_track_name}")
-
-            search_query = f"{original_artist_name} - {original_track_name} audio"
-            output_template = os.path.join(self.download_path.get(), f"{sanitized_artist_name} - {sanitized_track_name}")
-            self.log_status(f"-> Searching: {original_track_name}")
-
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'mp3', 'preferredquality': self.quality_var.get()}],
-                'outtmpl': output_template, 'quiet': True, 'noplaylist': True,
-            }
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([f"ytsearch1:{search_query}"])
-            
-            self.embed_metadata(final_filepath, track_info)
-            self.log_status(f"-> Downloaded & tagged: {original_track_name}")
-            return {'status': 'success', 'name': original_track_name}
-
-        except Exception as e:
-            self.log_status(f"-> Failed: {original_track_name}")
-            return {'status': 'failure', 'data': {'track': original_track_name, 'artist': original_artist_name, 'reason': e}}
-
-    def embed_metadata(self, file_path, track_info):
-        title, artist = track_info['name'], track_info['artists'][0]['name']
-        album = track_info['album']['name']
-        release_date = track_info['album']['release_date']
-        track_num, disc_num = track_info.get('track_number'), track_info.get('disc_number')
-        image_url = track_info['album']['images'][0]['url'] if track_info['album']['images'] else None
-
-        audio = MP3(file_path, ID3=ID3)
-        if image_url:
-            try:
-                image_data = requests.get(image_url).content
-                audio.tags.add(APIC(encoding=3, mime='image/jpeg', type=3, desc='Cover', data=image_data))
-            except Exception:
-                pass
-
-        audio.tags.add(TIT2(encoding=3, text=title))
-        audio.tags.add(TPE1(encoding=3, text=artist))
-        audio.tags.add(TALB(encoding=3, text=album))
-        audio.tags.add(TDRC(encoding=3, text=release_date.split('-')[0]))
-        if track_num:
-            audio.tags.add(TRCK(encoding=3, text=str(track_num)))
-        if disc_num:
-            audio.tags.add(TPOS(encoding=3, text=str(disc_num)))
-        audio.save()
+    def handle_engine_event(self, event):
+        kind = event['event']
+        if kind == 'log':
+            self.log_status(event['message'])
+        elif kind == 'error':
+            self.log_status(f"An error occurred: {event['message']}")
+        elif kind == 'track':
+            self.ui_queue.put(('progress', event['completed'] / event['total']))
+        elif kind == 'stats':
+            self.ui_queue.put(('stats', format_stats(event['stages'])))
+        elif kind == 'metrics':
+            self.post_to_ui(self.show_timing, event)
 
     def reset_ui_state(self):
         self.download_button.configure(state="normal")
@@ -437,37 +579,54 @@ class App(ctk.CTk):
         self.summary_total_label.configure(text=f"Total: {total_tracks}")
         self.summary_success_label.configure(text=f"Successful: {success_count}")
         self.summary_failed_label.configure(text=f"Failed: {failed_count}")
+        self.retry_failed_button.configure(state="normal" if failed_count else "disabled")
         for item in self.failed_downloads:
-            reason = str(item['reason']).splitlines()[0]
+            reason = first_line(item['reason'])
             fail_text = f"{item['artist']} - {item['track']}\nReason: {reason}"
             ctk.CTkLabel(self.failed_scrollable_frame, text=fail_text, justify="left", anchor="w").pack(pady=2, padx=5, fill="x")
         self.tab_view.set("Results")
     
-    def refresh_library(self):
-        for widget in self.library_scrollable_frame.winfo_children():
-            widget.destroy()
+    def show_timing(self, event):
+        parts = [
+            f"{histogram['name'][:-len('_seconds')]} p50 {histogram['p50']:.2f}s p90 {histogram['p90']:.2f}s"
+            for histogram in event['histograms'] if histogram['count']
+        ]
+        self.timing_label.configure(text="Timing: " + " | ".join(parts) + f"\nFull report: {event['path']}")
+
+    def refresh_library(self, force=False):
+        if self.library_scan_thread and self.library_scan_thread.is_alive():
+            return
         download_dir = self.download_path.get()
-        if not os.path.isdir(download_dir): return
-        mp3_files = glob.glob(os.path.join(download_dir, "*.mp3"))
-        for file_path in sorted(mp3_files, key=os.path.getmtime, reverse=True):
-            filename = os.path.basename(file_path)
-            item_frame = ctk.CTkFrame(self.library_scrollable_frame)
-            item_frame.pack(fill="x", padx=5, pady=2)
-            label = ctk.CTkLabel(item_frame, text=filename, anchor="w")
-            label.pack(side="left", expand=True, fill="x", padx=5)
-            show_button = ctk.CTkButton(item_frame, text="Folder", width=60, command=lambda p=file_path: self.show_in_folder(p), **self.get_button_style())
-            show_button.pack(side="right", padx=2)
-            play_button = ctk.CTkButton(item_frame, text="Play", width=50, command=lambda p=file_path: self.play_track(p), **self.get_button_style())
-            play_button.pack(side="right", padx=2)
-            
+        self.library_scan_thread = threading.Thread(target=self.load_library, args=(download_dir, force), daemon=True)
+        self.library_scan_thread.start()
+        self.after(50, self.finish_library_refresh)
+
+    def load_library(self, download_dir, force):
+        # Runs in the background. Whatever the index already knows is shown
+        # in batches first; the check of the folder for changes follows.
+        if self.library_index is None:
+            from library import LibraryIndex
+            self.library_index = LibraryIndex(library_index_path_for(self.CONFIG_FILE))
+        for _ in self.library_index.preload(download_dir):
+            self.post_to_ui(self.apply_library_filter, True)
+        self.library_index.scan(download_dir, force)
+
+    def finish_library_refresh(self):
+        if self.library_scan_thread.is_alive():
+            self.after(50, self.finish_library_refresh)
+            return
+        self.apply_library_filter()
+
     def filter_library(self, event=None):
-        query = self.search_library_entry.get().lower()
-        for item_frame in self.library_scrollable_frame.winfo_children():
-            label = item_frame.winfo_children()[0]
-            if query in label.cget("text").lower():
-                item_frame.pack(fill="x", padx=5, pady=2)
-            else:
-                item_frame.pack_forget()
+        if self.library_filter_job:
+            self.after_cancel(self.library_filter_job)
+        self.library_filter_job = self.after(200, self.apply_library_filter)
+
+    def apply_library_filter(self, keep_position=False):
+        self.library_filter_job = None
+        if self.library_index is None:
+            return
+        self.library_list.set_items(self.library_index.search(self.search_library_entry.get()), keep_position=keep_position)
 
     def play_track(self, file_path):
         try:
@@ -492,14 +651,6 @@ class App(ctk.CTk):
             self.log_status(f"Could not open folder: {e}")
 
 if __name__ == "__main__":
-    try:
-        from subprocess import run, DEVNULL
-        run(['ffmpeg', '-version'], stdout=DEVNULL, stderr=DEVNULL)
-    except FileNotFoundError:
-        print("\n" + "="*70)
-        print("WARNING: FFmpeg not found!")
-        print("Please download it from https://ffmpeg.org/download.html")
-        print("and add its 'bin' folder to your system's PATH environment variable.")
-        print("="*70 + "\n")
+    multiprocessing.freeze_support()
     app = App()
     app.mainloop()
\ No newline at end of file
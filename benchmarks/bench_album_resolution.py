@@ -0,0 +1,55 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_spotify import MockCatalog, MockSpotifyServer, mock_spotify_client
+from resolver import resolve_albums
+
+
+def legacy_resolve_albums(sp, album_ids):
+    # The per-track loop run_download_job used before batching.
+    tracks_to_process = []
+    for album_id in album_ids:
+        album_tracks = sp.album_tracks(album_id)['items']
+        album_details = sp.album(album_id)
+        for track_stub in album_tracks:
+            full_track = sp.track(track_stub['id'])
+            full_track['album'] = album_details
+            tracks_to_process.append(full_track)
+    return tracks_to_process
+
+
+def run_case(server, sp, label, resolve, album_ids):
+    server.reset_counters()
+    start = time.perf_counter()
+    tracks = resolve(sp, album_ids)
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<8} tracks={len(tracks):>4}  round_trips={server.total_calls:>4}  time_to_first_download={elapsed * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-track and batched album resolution against a mock Spotify API.")
+    parser.add_argument('--latency', type=float, default=0.03, help="Simulated per-request latency in seconds.")
+    args = parser.parse_args()
+
+    scenarios = {
+        'deluxe album (30 tracks)': {'deluxe': 30},
+        'box set (140 tracks)': {'boxset': 140},
+        'discography (12 albums x 14 tracks)': {f"disc{i:02d}": 14 for i in range(12)},
+        'box set discography (6 albums x 60 tracks)': {f"box{i:02d}": 60 for i in range(6)},
+    }
+    catalog = MockCatalog({album_id: count for albums in scenarios.values() for album_id, count in albums.items()})
+
+    with MockSpotifyServer(catalog, latency=args.latency) as server:
+        sp = mock_spotify_client(server)
+        for name, albums in scenarios.items():
+            print(name)
+            run_case(server, sp, 'legacy', legacy_resolve_albums, list(albums))
+            run_case(server, sp, 'batched', resolve_albums, list(albums))
+
+
+if __name__ == '__main__':
+    main()
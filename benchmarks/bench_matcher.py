@@ -0,0 +1,54 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from matcher import pick_best
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'matcher_cases.json')
+
+
+def first_result(track, candidates):
+    # The old behaviour: ytsearch1 and take whatever came first.
+    return (candidates[0], None) if candidates else (None, None)
+
+
+def run_case(label, pick, cases, repeat):
+    correct = 0
+    misses = []
+    for case in cases:
+        best, _ = pick(case['track'], case['candidates'])
+        chosen = best['id'] if best else None
+        if chosen == case['expected']:
+            correct += 1
+        else:
+            misses.append(f"{case['track']['name']} -> {chosen} (expected {case['expected']})")
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for case in cases:
+            pick(case['track'], case['candidates'])
+    per_match = (time.perf_counter() - start) / (repeat * len(cases))
+    print(f"  {label:<8} accuracy={correct}/{len(cases)} ({correct / len(cases):.0%})  time_per_match={per_match * 1e6:8.1f} us")
+    for miss in misses:
+        print(f"      miss: {miss}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Match accuracy and time per match on candidate fixtures in the shape of flat yt-dlp search results.")
+    parser.add_argument('--fixtures', default=FIXTURES)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    with open(args.fixtures, 'r', encoding='utf-8') as f:
+        cases = json.load(f)
+    print(f"{len(cases)} cases from {os.path.relpath(args.fixtures)}")
+    run_case('first', first_result, cases, args.repeat)
+    run_case('matcher', pick_best, cases, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
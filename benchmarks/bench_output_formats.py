@@ -0,0 +1,92 @@
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from media import convert_audio, staged_output_path
+
+# Sources shaped like what yt-dlp picks on YouTube: Opus in WebM, AAC in MP4.
+SOURCES = {
+    'opus': ('source.webm', ['-codec:a', 'libopus', '-b:a', '160k'], 'opus'),
+    'aac': ('source.m4a', ['-codec:a', 'aac', '-b:a', '128k'], 'mp4a.40.2'),
+}
+
+MODES = [
+    ('mp3 re-encode', 'opus', [['mp3']]),
+    ('opus passthrough', 'opus', [['opus']]),
+    ('m4a passthrough', 'aac', [['m4a']]),
+    ('mp3+opus, 2 runs', 'opus', [['mp3'], ['opus']]),
+    ('mp3+opus, 1 decode', 'opus', [['mp3', 'opus']]),
+    ('mp3+m4a, 2 runs', 'opus', [['mp3'], ['m4a']]),
+    ('mp3+m4a, 1 decode', 'opus', [['mp3', 'm4a']]),
+]
+
+
+def make_sources(directory, seconds):
+    # Pink noise keeps the encoders about as busy as music does; a pure tone would not.
+    for name, (filename, codec_args, _) in SOURCES.items():
+        path = os.path.join(directory, filename)
+        subprocess.run(
+            ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error', '-f', 'lavfi', '-i', f"anoisesrc=d={seconds}:c=pink:a=0.3",
+             '-ac', '2', '-ar', '48000', *codec_args, path],
+            check=True,
+        )
+
+
+def children_cpu_seconds():
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+def run_mode(directory, label, source, runs, tracks, quality):
+    filename, _, codec = SOURCES[source]
+    cpu_start, wall_start = children_cpu_seconds(), time.perf_counter()
+    for track in range(tracks):
+        for formats in runs:
+            # Staged and named the way the engine does it: yt-dlp's
+            # <video_id>.<ext> next to the outputs, which convert_audio
+            # consumes.
+            video_id = f"track{track}"
+            staged = os.path.join(directory, video_id + os.path.splitext(filename)[1])
+            shutil.copyfile(os.path.join(directory, filename), staged)
+            outputs = [(name, staged_output_path(directory, video_id, name)) for name in formats]
+            for _, path in outputs:
+                if os.path.exists(path):
+                    os.remove(path)
+            for path in convert_audio(staged, outputs, codec, quality):
+                if not os.path.exists(path):
+                    sys.exit(f"{label}: {os.path.basename(path)} is missing after the transcode.")
+    cpu = (children_cpu_seconds() - cpu_start) / tracks
+    wall = (time.perf_counter() - wall_start) / tracks
+    print(f"  {label:<20} cpu={cpu * 1000:8.1f} ms/track  wall={wall * 1000:8.1f} ms/track")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ffmpeg CPU time per track for each output mode, on locally generated sample audio.")
+    parser.add_argument('--tracks', type=int, default=3)
+    parser.add_argument('--seconds', type=int, default=180, help="Length of the sample track.")
+    parser.add_argument('--quality', default="320")
+    args = parser.parse_args()
+
+    if shutil.which('ffmpeg') is None:
+        sys.exit("ffmpeg was not found on PATH.")
+    if os.name == 'nt':
+        print("Note: child process CPU time is not reported on Windows; only wall time is meaningful there.")
+
+    directory = tempfile.mkdtemp()
+    try:
+        make_sources(directory, args.seconds)
+        print(f"{args.tracks} tracks of {args.seconds} s, re-encodes at {args.quality} kbps")
+        for label, source, runs in MODES:
+            run_mode(directory, label, source, runs, args.tracks, args.quality)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_spotify import MockCatalog, MockSpotifyServer, mock_spotify_client
+from resolver import stream_playlist
+
+
+def legacy_pages(sp, playlist_id):
+    # What run_download_job did: follow `next` until the last page, then hand
+    # the whole list over at once.
+    results = sp.playlist_tracks(playlist_id)
+    items = results['items']
+    while results['next']:
+        results = sp.next(results)
+        items.extend(results['items'])
+    yield [item['track'] for item in items if item and item.get('track')]
+
+
+def run_case(server, sp, label, pages, playlist_id, per_track):
+    server.reset_counters()
+    tracemalloc.start()
+    start = time.perf_counter()
+    first = None
+    count = 0
+    for page in pages(sp, playlist_id):
+        for track in page:
+            if first is None:
+                first = time.perf_counter() - start
+            count += 1
+            # Stands in for the pipeline's bounded queue taking its time.
+            time.sleep(per_track)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  {label:<10} tracks={count:>6}  round_trips={server.total_calls:>4}  first_track={first * 1000:8.1f} ms"
+          f"  total={elapsed:6.2f} s  peak_memory={peak / 1024 / 1024:6.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time to first track and peak memory for a large playlist, collect-all versus streamed pages.")
+    parser.add_argument('--tracks', type=int, default=10000)
+    parser.add_argument('--latency', type=float, default=0.03, help="Simulated per-request latency in seconds.")
+    parser.add_argument('--per-track', type=float, default=0.0002, help="Simulated consumer time per track in seconds.")
+    args = parser.parse_args()
+
+    albums = {f"album{i:04d}": 20 for i in range((args.tracks + 19) // 20)}
+    track_ids = [f"{album_id}t{i:04d}" for album_id, count in albums.items() for i in range(count)][:args.tracks]
+    catalog = MockCatalog(albums, playlists={'big': ('snapshot1', track_ids)})
+
+    with MockSpotifyServer(catalog, latency=args.latency) as server:
+        sp = mock_spotify_client(server)
+        print(f"playlist with {args.tracks} tracks, {args.latency * 1000:.0f} ms per request")
+        run_case(server, sp, 'legacy', legacy_pages, 'big', args.per_track)
+        run_case(server, sp, 'streaming', lambda sp, playlist_id: stream_playlist(sp, playlist_id), 'big', args.per_track)
+
+
+if __name__ == '__main__':
+    main()
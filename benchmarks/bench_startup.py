@@ -0,0 +1,158 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only needed once a download starts or the library is read, so importing
+# any of these before the window shows is a regression.
+DEFERRED_MODULES = ('engine', 'spotipy', 'requests', 'yt_dlp', 'mutagen', 'dedup', 'library')
+
+# Runs in a fresh interpreter with the synthetic library's folder as the
+# working directory, where App finds its config.json.
+STARTUP_PROBE = r"""
+import json, sys, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+try:
+    window = app.App()
+    window.update()
+except Exception as e:
+    print(json.dumps({'error': str(e)}))
+    sys.exit()
+painted = time.perf_counter()
+first_rows = None
+while True:
+    window.update()
+    if first_rows is None and window.library_list.items:
+        first_rows = time.perf_counter()
+    if window.library_scan_thread and not window.library_scan_thread.is_alive() and window.ui_queue.empty():
+        window.update()
+        break
+    time.sleep(0.002)
+loaded = time.perf_counter()
+result = {
+    'import': imported - started, 'paint': painted - started, 'first_rows': (first_rows or loaded) - started,
+    'loaded': loaded - started, 'rows': len(window.library_list.items),
+}
+window.destroy()
+print(json.dumps(result))
+"""
+
+
+def parse_importtime(stderr):
+    # Lines look like "import time:   self [us] | cumulative | <indent>name".
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append({
+            'name': name.strip(), 'depth': (len(name) - len(name.lstrip()) - 1) // 2,
+            'self': int(self_us) / 1000, 'cumulative': int(cumulative_us) / 1000,
+        })
+    return modules
+
+
+def measure_imports(runs):
+    totals = []
+    for _ in range(runs):
+        completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=ROOT, capture_output=True, text=True)
+        if completed.returncode != 0:
+            sys.exit(completed.stderr)
+        modules = parse_importtime(completed.stderr)
+        app_entry = next(module for module in modules if module['name'] == 'app' and module['depth'] == 0)
+        totals.append(app_entry['cumulative'])
+    # Children of app are listed before it, at depth 1.
+    end = modules.index(app_entry)
+    start = end
+    while start > 0 and modules[start - 1]['depth'] >= 1:
+        start -= 1
+    children = [module for module in modules[start:end] if module['depth'] == 1]
+    imported = {module['name'] for module in modules}
+    return statistics.median(totals), children, imported
+
+
+def make_library(directory, size):
+    for index in range(size):
+        open(os.path.join(directory, f"Artist {index % 500} - Title {index}.mp3"), 'wb').close()
+
+
+def measure_interactive(size):
+    workdir = tempfile.mkdtemp()
+    try:
+        library = os.path.join(workdir, "downloads")
+        os.makedirs(library)
+        make_library(library, size)
+        shutil.copyfile(os.path.join(ROOT, "icon.ico"), os.path.join(workdir, "icon.ico"))
+        with open(os.path.join(workdir, "config.json"), 'w') as f:
+            json.dump({'download_path': library}, f)
+        env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+        results = []
+        # The first launch builds the library index; the second reads it.
+        for _ in range(2):
+            completed = subprocess.run([sys.executable, '-c', STARTUP_PROBE], cwd=workdir, env=env, capture_output=True, text=True)
+            lines = completed.stdout.strip().splitlines()
+            if completed.returncode != 0 or not lines:
+                return {'error': completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "probe failed"}, []
+            result = json.loads(lines[-1])
+            if 'error' in result:
+                return result, []
+            results.append(result)
+        return None, results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time of app.py (-X importtime) and time to first paint and to a loaded Library tab, against budgets.")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--import-budget-ms', type=float, default=250)
+    parser.add_argument('--paint-budget-ms', type=float, default=1000)
+    parser.add_argument('--library-size', type=int, default=20000)
+    args = parser.parse_args()
+
+    failures = []
+    total, children, imported = measure_imports(args.runs)
+    print(f"import app: {total:.1f} ms (median of {args.runs}, budget {args.import_budget_ms:.0f} ms)")
+    for module in sorted(children, key=lambda module: module['cumulative'], reverse=True)[:8]:
+        print(f"  {module['name']:<24} {module['cumulative']:8.1f} ms")
+    if total > args.import_budget_ms:
+        failures.append(f"import time {total:.1f} ms is over budget")
+    early = [name for name in DEFERRED_MODULES if name in imported]
+    if early:
+        failures.append(f"imported at startup: {', '.join(early)}")
+
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg:
+        import time
+        started = time.perf_counter()
+        subprocess.run([ffmpeg, '-version'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        spawned = time.perf_counter() - started
+        started = time.perf_counter()
+        shutil.which('ffmpeg')
+        looked_up = time.perf_counter() - started
+        print(f"ffmpeg probe: spawn {spawned * 1000:.1f} ms, PATH lookup {looked_up * 1000:.2f} ms")
+
+    error, results = measure_interactive(args.library_size)
+    if error:
+        print(f"Time to interactive not measured ({error['error']}); it needs a display.")
+    for label, result in zip(("cold index", "warm index"), results):
+        print(f"{label}, {result['rows']} files: paint {result['paint'] * 1000:.0f} ms, first rows {result['first_rows'] * 1000:.0f} ms, "
+              f"fully loaded {result['loaded'] * 1000:.0f} ms")
+        if result['paint'] * 1000 > args.paint_budget_ms:
+            failures.append(f"first paint ({label}) took {result['paint'] * 1000:.0f} ms")
+
+    for failure in failures:
+        print(f"OVER BUDGET: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
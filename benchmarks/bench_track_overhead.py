@@ -0,0 +1,157 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from net import ThreadLocalYoutubeDL, create_session
+
+AUDIO_BYTES = b'\xff\xfb\x90\x00' * 16384
+COVER_BYTES = b'\xff\xd8\xff\xe0' + b'\x00' * 65536
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients dropping idle keep-alive connections is expected here.
+        pass
+
+
+class StubServer:
+    # Serves a fake audio file and cover image over HTTP/1.1 keep-alive. Every
+    # new TCP connection sleeps for handshake_delay to stand in for the TLS
+    # handshake a real CDN connection would cost.
+    def __init__(self, handshake_delay):
+        self.connections = 0
+        self.requests = 0
+        # Handlers run on the server's threads, one per connection.
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with stub.lock:
+                    stub.connections += 1
+                time.sleep(handshake_delay)
+
+            def do_GET(self):
+                self.send_body('image/jpeg' if self.path.endswith('.jpg') else 'audio/mpeg')
+
+            def do_HEAD(self):
+                self.send_body('audio/mpeg', head=True)
+
+            def send_body(self, content_type, head=False):
+                with stub.lock:
+                    stub.requests += 1
+                body = COVER_BYTES if content_type == 'image/jpeg' else AUDIO_BYTES
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if not head:
+                    self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = QuietHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def url(self, path):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}{path}"
+
+    def reset(self):
+        with self.lock:
+            self.connections = self.requests = 0
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def ydl_options(output_dir):
+    return {'quiet': True, 'noprogress': True, 'outtmpl': os.path.join(output_dir, '%(id)s-%(autonumber)s.%(ext)s')}
+
+
+def fresh_per_track(server, output_dir, index):
+    # What download_single_track did: a new YoutubeDL and a bare requests.get per track.
+    import requests
+    import yt_dlp
+    with yt_dlp.YoutubeDL(ydl_options(output_dir)) as ydl:
+        ydl.extract_info(server.url(f"/track{index}.mp3"), download=True)
+    requests.get(server.url("/cover.jpg")).content
+
+
+def make_reused(output_dir):
+    ydl_pool = ThreadLocalYoutubeDL(ydl_options(output_dir))
+    session = create_session()
+
+    def reused(server, output_dir, index):
+        ydl_pool.get().extract_info(server.url(f"/track{index}.mp3"), download=True)
+        session.get(server.url("/cover.jpg")).content
+
+    def close():
+        ydl_pool.close()
+        session.close()
+
+    return reused, close
+
+
+def run(label, server, per_track, tracks, workers, output_dir):
+    server.reset()
+    indices = iter(range(tracks))
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                index = next(indices, None)
+            if index is None:
+                return
+            per_track(server, output_dir, index)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<10} {elapsed / tracks * 1000:8.1f} ms/track  tcp_connections={server.connections:>4}  requests={server.requests:>4}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-track YoutubeDL and HTTP overhead, fresh objects versus reused ones.")
+    parser.add_argument('--tracks', type=int, default=40)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--handshake-delay', type=float, default=0.05, help="Simulated seconds per new connection (TLS handshake).")
+    args = parser.parse_args()
+
+    server = StubServer(args.handshake_delay)
+    output_dir = tempfile.mkdtemp()
+    try:
+        print(f"{args.tracks} tracks, {args.workers} workers, {args.handshake_delay * 1000:.0f} ms simulated handshake")
+        # Each run gets its own folder: yt-dlp skips files that already
+        # exist, and %(autonumber)s restarts with every YoutubeDL.
+        fresh_dir, reused_dir = os.path.join(output_dir, "fresh"), os.path.join(output_dir, "reused")
+        run('fresh', server, fresh_per_track, args.tracks, args.workers, fresh_dir)
+        reused, close = make_reused(reused_dir)
+        run('reused', server, reused, args.tracks, args.workers, reused_dir)
+        close()
+    finally:
+        server.stop()
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+import json
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+PAGE_LIMIT = 50
+PLAYLIST_PAGE_LIMIT = 100
+
+
+class MockCatalog:
+    def __init__(self, albums=None, playlists=None):
+        self.albums = dict(albums or {})
+        # playlist_id -> (snapshot_id, [track_id, ...])
+        self.playlists = dict(playlists or {})
+
+    def track_ids(self, album_id):
+        return [f"{album_id}t{i:04d}" for i in range(self.albums[album_id])]
+
+    def album_of(self, track_id):
+        return track_id.rsplit('t', 1)[0]
+
+    def simple_track(self, track_id):
+        index = int(track_id.rsplit('t', 1)[1])
+        return {
+            'id': track_id, 'name': f"Track {index + 1}", 'duration_ms': 180000 + index * 1000,
+            'artists': [{'id': 'artist0', 'name': 'Mock Artist'}],
+            'track_number': index + 1, 'disc_number': 1,
+        }
+
+    def album_stub(self, album_id):
+        return {
+            'id': album_id, 'name': f"Album {album_id}", 'release_date': '2020-01-01',
+            'images': [{'url': 'http://127.0.0.1/cover.jpg', 'width': 640, 'height': 640}],
+        }
+
+    def full_track(self, track_id):
+        album_id = self.album_of(track_id)
+        if album_id not in self.albums:
+            return None
+        return dict(self.simple_track(track_id), album=self.album_stub(album_id), external_ids={'isrc': f"MOCK{track_id}"})
+
+    def album_tracks_page(self, base_url, album_id, offset, limit):
+        ids = self.track_ids(album_id)
+        items = [self.simple_track(track_id) for track_id in ids[offset:offset + limit]]
+        next_url = None
+        if offset + limit < len(ids):
+            next_url = f"{base_url}/v1/albums/{album_id}/tracks?offset={offset + limit}&limit={limit}"
+        return {'items': items, 'total': len(ids), 'limit': limit, 'offset': offset, 'next': next_url}
+
+    def playlist_tracks_page(self, base_url, playlist_id, offset, limit):
+        snapshot_id, track_ids = self.playlists[playlist_id]
+        items = [{'track': self.full_track(track_id)} for track_id in track_ids[offset:offset + limit]]
+        next_url = None
+        if offset + limit < len(track_ids):
+            next_url = f"{base_url}/v1/playlists/{playlist_id}/tracks?offset={offset + limit}&limit={limit}"
+        return {'items': items, 'total': len(track_ids), 'limit': limit, 'offset': offset, 'next': next_url}
+
+    def playlist(self, base_url, playlist_id):
+        if playlist_id not in self.playlists:
+            return None
+        snapshot_id, track_ids = self.playlists[playlist_id]
+        return {
+            'id': playlist_id, 'name': f"Playlist {playlist_id}", 'snapshot_id': snapshot_id,
+            'tracks': self.playlist_tracks_page(base_url, playlist_id, 0, PLAYLIST_PAGE_LIMIT),
+        }
+
+    def full_album(self, base_url, album_id):
+        if album_id not in self.albums:
+            return None
+        return dict(self.album_stub(album_id), tracks=self.album_tracks_page(base_url, album_id, 0, PAGE_LIMIT))
+
+
+class MockSpotifyServer:
+    def __init__(self, catalog, latency=0.02):
+        self.catalog = catalog
+        self.latency = latency
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls.clear()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def route(self, path, query):
+        catalog, base_url = self.catalog, self.base_url
+        parts = [part for part in path.split('/') if part][1:]
+        ids = query.get('ids', [''])[0].split(',') if 'ids' in query else []
+        offset = int(query.get('offset', ['0'])[0])
+        limit = int(query.get('limit', [str(PAGE_LIMIT)])[0])
+
+        if parts == ['albums']:
+            return 'albums', {'albums': [catalog.full_album(base_url, album_id) for album_id in ids]}
+        if len(parts) == 2 and parts[0] == 'albums':
+            return 'album', catalog.full_album(base_url, parts[1])
+        if len(parts) == 3 and parts[0] == 'albums' and parts[2] == 'tracks':
+            return 'album_tracks', catalog.album_tracks_page(base_url, parts[1], offset, limit)
+        if parts == ['tracks']:
+            return 'tracks', {'tracks': [catalog.full_track(track_id) for track_id in ids]}
+        if len(parts) == 2 and parts[0] == 'tracks':
+            return 'track', catalog.full_track(parts[1])
+        if len(parts) == 2 and parts[0] == 'playlists':
+            playlist = catalog.playlist(base_url, parts[1])
+            if playlist is not None and query.get('fields') == ['snapshot_id']:
+                playlist = {'snapshot_id': playlist['snapshot_id']}
+            return 'playlist', playlist
+        if len(parts) == 3 and parts[0] == 'playlists' and parts[2] in ('tracks', 'items'):
+            limit = int(query.get('limit', [str(PLAYLIST_PAGE_LIMIT)])[0])
+            return 'playlist_tracks', catalog.playlist_tracks_page(base_url, parts[1], offset, limit)
+        return 'unknown', None
+
+    def _make_handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                endpoint, body = mock.route(url.path, parse_qs(url.query))
+                with mock._lock:
+                    mock.calls[endpoint] += 1
+                if mock.latency:
+                    time.sleep(mock.latency)
+                payload = json.dumps(body).encode() if body is not None else b'{"error": {"status": 404}}'
+                self.send_response(200 if body is not None else 404)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def mock_spotify_client(server):
+    import spotipy
+    sp = spotipy.Spotify(auth='mock-token', retries=0, status_retries=0)
+    sp.prefix = server.base_url + '/v1/'
+    return sp
@@ -0,0 +1,160 @@
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from net import create_session
+from scheduler import Upstream
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass
+
+
+class FakeUpstream:
+    # Behaves like a rate-limited API: more than `rate` requests per second get
+    # a 429 with Retry-After, latency grows once more than `capacity` requests
+    # are in flight, and error_rate of the requests fail with a 503.
+    def __init__(self, rate, capacity, latency, error_rate, retry_after):
+        self.rate = rate
+        self.capacity = capacity
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.active = 0
+        self.counts = {200: 0, 429: 0, 503: 0}
+        self._lock = threading.Lock()
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                status = upstream.admit()
+                headers = {'Retry-After': str(upstream.retry_after)} if status == 429 else {}
+                if status == 200:
+                    try:
+                        time.sleep(upstream.latency * max(1.0, upstream.active / upstream.capacity))
+                    finally:
+                        with upstream._lock:
+                            upstream.active -= 1
+                    if random.random() < upstream.error_rate:
+                        status = 503
+                with upstream._lock:
+                    upstream.counts[status] += 1
+                body = b'ok' if status == 200 else b'error'
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = QuietHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def admit(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return 429
+            self.tokens -= 1
+            self.active += 1
+            return 200
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}/item"
+
+    def reset(self):
+        with self._lock:
+            self.counts = {200: 0, 429: 0, 503: 0}
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def run(label, fake, requests_total, workers, upstream=None):
+    fake.reset()
+    session = create_session(pool_size=workers, retries=0)
+    indices = iter(range(requests_total))
+    lock = threading.Lock()
+    outcome = {'ok': 0, 'failed': 0}
+
+    def get():
+        response = session.get(fake.url, timeout=30)
+        response.raise_for_status()
+        return response.content
+
+    def worker():
+        while True:
+            with lock:
+                if next(indices, None) is None:
+                    return
+            try:
+                upstream.call(get) if upstream else get()
+                key = 'ok'
+            except Exception:
+                key = 'failed'
+            with lock:
+                outcome[key] += 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    session.close()
+
+    line = (f"  {label:<16} {elapsed:6.2f} s  {outcome['ok'] / elapsed:6.1f} ok/s  failed={outcome['failed'] / requests_total:6.1%}"
+            f"  server: 429s={fake.counts[429]:>4} 503s={fake.counts[503]:>4}")
+    if upstream:
+        stats = upstream.stats()
+        line += f"  retries={stats['retries']:>4} final_limit={stats['limit']}"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput and failure rate against a fake upstream that injects 429s, 503s and latency.")
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--server-rate', type=float, default=40, help="Requests per second the fake upstream accepts before answering 429.")
+    parser.add_argument('--capacity', type=int, default=4, help="Concurrent requests before the fake upstream slows down.")
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0.02)
+    parser.add_argument('--retry-after', type=int, default=1)
+    args = parser.parse_args()
+
+    fake = FakeUpstream(args.server_rate, args.capacity, args.latency, args.error_rate, args.retry_after)
+    try:
+        print(f"{args.requests} requests, {args.workers} workers; upstream accepts {args.server_rate:.0f}/s, "
+              f"slows down past {args.capacity} in flight, {args.error_rate:.0%} random 503s")
+        run('fixed pool', fake, args.requests, args.workers)
+        run('adaptive', fake, args.requests, args.workers, Upstream("fake", max_concurrency=args.workers, latency_tolerance=3.0))
+        run('adaptive+bucket', fake, args.requests, args.workers,
+            Upstream("fake", rate=args.server_rate * 0.9, max_concurrency=args.workers, latency_tolerance=3.0))
+    finally:
+        fake.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+PRIORITIES = {'low': -1, 'normal': 0, 'high': 1}
+BURST_SECONDS = 1.0
+BUDGET_FILE = "spotify-downloader-budgets.sqlite3"
+# A waiter that has not been seen for this long has finished, or its
+# process was killed.
+WAITER_TIMEOUT = 1.0
+
+SHARED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS waiters (id TEXT PRIMARY KEY, bucket TEXT NOT NULL, priority INTEGER NOT NULL, seen REAL NOT NULL);
+"""
+
+
+class ByteBudget:
+    # Token bucket over bytes. Callers report what they have just written or
+    # received and wait until the budget has caught up, so the bucket can go
+    # into debt by one chunk and the cap holds on average. While callers of a
+    # higher priority are waiting, lower priorities are held back.
+    def __init__(self, rate=None):
+        self.rate = None
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self._waiting = {}
+        self._condition = threading.Condition()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        # rate in bytes per second; None or 0 removes the cap.
+        with self._condition:
+            self.rate = rate or None
+            self.tokens = min(self.tokens, self.rate * BURST_SECONDS) if self.rate else 0.0
+            self.updated = time.monotonic()
+            self._condition.notify_all()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate * BURST_SECONDS, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, amount, priority=0, is_stopped=None):
+        # Returns False if is_stopped was set while waiting.
+        if amount <= 0 or not self.rate:
+            return True
+        with self._condition:
+            self._waiting[priority] = self._waiting.get(priority, 0) + 1
+            try:
+                while True:
+                    if not self.rate:
+                        return True
+                    self._refill()
+                    outranked = any(count for waiting, count in self._waiting.items() if waiting > priority)
+                    if self.tokens >= 0 and not outranked:
+                        self.tokens -= amount
+                        return True
+                    if is_stopped is not None and is_stopped.is_set():
+                        return False
+                    wait = -self.tokens / self.rate if self.tokens < 0 else 0.05
+                    self._condition.wait(min(max(wait, 0.01), 0.5))
+            finally:
+                self._waiting[priority] -= 1
+                self._condition.notify_all()
+
+
+class SharedByteBudget:
+    # ByteBudget shared by every process on the machine through a small
+    # SQLite file, so two jobs started by cron, or the GUI next to a CLI
+    # sync, split the cap instead of each getting all of it. Waiting callers
+    # register with their priority, so a higher-priority job in another
+    # process holds back lower ones. Each process refills the bucket at its
+    # own configured rate; processes without a cap do not take part.
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+        self.rate = None
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def set_rate(self, rate):
+        self.rate = rate or None
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            # The state is only worth a second or so, so durability is not needed.
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=OFF")
+            self._conn.executescript(SHARED_SCHEMA)
+        return self._conn
+
+    def _attempt(self, amount, priority, waiter):
+        # One transaction: refill, and take the bytes unless the bucket is in
+        # debt or a live waiter of a higher priority exists. Returns the
+        # seconds to wait before trying again, or None once taken.
+        rate = self.rate
+        with self._lock:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (self.name,)).fetchone()
+                tokens, updated = row if row else (0.0, now)
+                tokens = min(rate * BURST_SECONDS, tokens + max(now - updated, 0) * rate)
+                outranked = conn.execute(
+                    "SELECT 1 FROM waiters WHERE bucket = ? AND priority > ? AND seen > ? AND id != ? LIMIT 1",
+                    (self.name, priority, now - WAITER_TIMEOUT, waiter),
+                ).fetchone()
+                wait = None
+                if tokens >= 0 and not outranked:
+                    tokens -= amount
+                    # A caller that had to wait stays registered while it
+                    # keeps going, so lower priorities cannot slip in
+                    # between its chunks.
+                    conn.execute("UPDATE waiters SET seen = ? WHERE id = ?", (now, waiter))
+                else:
+                    wait = -tokens / rate if tokens < 0 else 0.05
+                    conn.execute("INSERT OR REPLACE INTO waiters (id, bucket, priority, seen) VALUES (?, ?, ?, ?)", (waiter, self.name, priority, now))
+                conn.execute("DELETE FROM waiters WHERE seen < ?", (now - WAITER_TIMEOUT,))
+                conn.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)", (self.name, tokens, now))
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        return wait
+
+    def _forget(self, waiter):
+        with self._lock:
+            self._connect().execute("DELETE FROM waiters WHERE id = ?", (waiter,))
+
+    def consume(self, amount, priority=0, is_stopped=None):
+        # Same contract as ByteBudget.consume.
+        if amount <= 0 or not self.rate:
+            return True
+        waiter = f"{os.getpid()}:{threading.get_ident()}"
+        while True:
+            wait = self._attempt(amount, priority, waiter)
+            if wait is None:
+                return True
+            if is_stopped is not None and is_stopped.is_set():
+                self._forget(waiter)
+                return False
+            time.sleep(min(max(wait, 0.01), WAITER_TIMEOUT / 4))
+
+
+_shared_budgets = {}
+_shared_budgets_lock = threading.Lock()
+
+
+def default_budget_path():
+    # Machine-wide unless budget_path points elsewhere.
+    return os.path.join(tempfile.gettempdir(), BUDGET_FILE)
+
+
+def shared_budgets(path=None):
+    # (bandwidth, disk writes) for the budget file, one pair per process, so
+    # every job in the process uses the same connection.
+    path = os.path.abspath(path or default_budget_path())
+    with _shared_budgets_lock:
+        if path not in _shared_budgets:
+            _shared_budgets[path] = (SharedByteBudget(path, 'bandwidth'), SharedByteBudget(path, 'disk_writes'))
+        return _shared_budgets[path]
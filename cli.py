@@ -0,0 +1,192 @@
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+
+from cache import MetadataCache
+from config import default_config_path, cache_path_for, download_index_path_for, load_config
+from dedup import DownloadIndex
+from engine import DownloadEngine
+from metrics import profiled, serve_metrics
+from workqueue import QueueBroker, SQLiteWorkQueue, open_queue, parse_address, worker_name
+
+
+def read_urls(args):
+    urls = list(args.urls)
+    for path in args.input_file:
+        f = sys.stdin if path == '-' else open(path, 'r')
+        try:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    urls.append(line)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+    return list(dict.fromkeys(urls))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Download Spotify tracks, albums and playlists without the GUI. Progress is written to stdout as JSON lines.")
+    parser.add_argument('urls', nargs='*', help="Spotify track, album or playlist URLs.")
+    parser.add_argument('-i', '--input-file', action='append', default=[], metavar='FILE', help="Read URLs from FILE, one per line ('-' for stdin). Can be repeated.")
+    parser.add_argument('--config', default=default_config_path(), help="Path to config.json (default: %(default)s).")
+    parser.add_argument('-o', '--output', help="Download directory (overrides download_path).")
+    parser.add_argument('-q', '--quality', choices=["128", "192", "256", "320"], help="Bitrate in kbps for re-encoded formats.")
+    parser.add_argument('-f', '--format', dest='output_format', help="Output format(s): mp3, opus or m4a, comma-separated for several (e.g. mp3,opus). opus and m4a copy the source audio without re-encoding when possible.")
+    parser.add_argument('--duplicates', choices=["skip", "overwrite"], help="What to do when the file already exists.")
+    parser.add_argument('--sync', action='store_true', help="Playlists only: download tracks added since the last sync, using a manifest in <download dir>/.sync.")
+    parser.add_argument('--prune', action='store_true', help="With --sync, delete files of tracks that were removed from the playlist.")
+    parser.add_argument('--resume', action='store_true', help="Continue the interrupted job in the download directory instead of starting a new one.")
+    parser.add_argument('--retry-failed', action='store_true', help="Retry only the tracks that failed in the last job.")
+    parser.add_argument('--priority', choices=["low", "normal", "high"], help="Job priority for shared bandwidth and queues (default: high for single tracks, low for --sync, normal otherwise).")
+    parser.add_argument('--limit-rate', type=int, metavar='KBPS', help="Cap this job's download bandwidth in KiB/s (overrides job_max_download_kbps).")
+    parser.add_argument('--queue', metavar='QUEUE', help="Distributed mode: a shared SQLite queue file, or tcp://HOST:PORT of a broker. With URLs, queues their tracks for workers and waits for them to finish.")
+    parser.add_argument('--worker', action='store_true', help="Download tracks from --queue until it is drained. Needs no Spotify credentials.")
+    parser.add_argument('--broker', metavar='[HOST:]PORT', help="Serve the SQLite --queue over TCP for workers on other machines (default host 127.0.0.1).")
+    parser.add_argument('--queue-status', action='store_true', help="Print the combined results of every worker for a job on --queue.")
+    parser.add_argument('--job', help="With --queue-status, the job ID to report on (default: the job queued last).")
+    parser.add_argument('--no-wait', action='store_true', help="With --queue and URLs, return once the tracks are queued.")
+    parser.add_argument('--metrics-file', help="Keep Prometheus text-format metrics in this file, rewritten every second while tracks are processed and once at the end (overrides metrics_file).")
+    parser.add_argument('--metrics-port', type=int, help="Serve Prometheus metrics on http://127.0.0.1:PORT/ while the job runs (overrides metrics_port).")
+    parser.add_argument('--profile', metavar='DIR', help="Run under cProfile and tracemalloc and write profile.pstats, profile.txt and memory.txt to DIR. ffmpeg and the transcode worker processes are not included.")
+    parser.add_argument('--search-workers', type=int)
+    parser.add_argument('--download-workers', type=int)
+    parser.add_argument('--transcode-workers', type=int)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    urls = read_urls(args)
+    resuming = args.resume or args.retry_failed
+    if resuming and (urls or args.sync):
+        parser.error("--resume and --retry-failed take no URLs and cannot be combined with --sync")
+    queue_mode = args.worker or args.broker or args.queue_status
+    if not urls and not resuming and not queue_mode:
+        parser.error("no URLs given")
+    if args.prune and not args.sync:
+        parser.error("--prune requires --sync")
+    if args.job and not args.queue_status:
+        parser.error("--job requires --queue-status")
+    if queue_mode and not args.queue:
+        parser.error("--worker, --broker and --queue-status require --queue")
+    if queue_mode and (urls or resuming or args.sync):
+        parser.error("--worker, --broker and --queue-status take no URLs")
+    if args.queue and (resuming or args.sync):
+        parser.error("--queue cannot be combined with --resume, --retry-failed or --sync")
+    if args.broker and args.queue.startswith("tcp://"):
+        parser.error("--broker serves a SQLite queue file, not another broker")
+
+    config = load_config(args.config)
+    overrides = {
+        "download_path": args.output, "quality": args.quality, "output_format": args.output_format, "duplicate_handling": args.duplicates,
+        "search_workers": args.search_workers, "download_workers": args.download_workers,
+        "transcode_workers": args.transcode_workers, "metrics_file": args.metrics_file, "metrics_port": args.metrics_port,
+        "priority": args.priority, "job_max_download_kbps": args.limit_rate,
+    }
+    config.update({key: value for key, value in overrides.items() if value is not None})
+    config["client_id"] = config["client_id"] or os.environ.get("SPOTIPY_CLIENT_ID", "")
+    config["client_secret"] = config["client_secret"] or os.environ.get("SPOTIPY_CLIENT_SECRET", "")
+
+    output_lock = threading.Lock()
+
+    def write_event(event):
+        line = json.dumps(event, default=str)
+        with output_lock:
+            sys.stdout.write(line + "\n")
+            sys.stdout.flush()
+
+    if args.broker:
+        work_queue = SQLiteWorkQueue(args.queue, lease_seconds=config["queue_lease_seconds"])
+        broker = QueueBroker(work_queue, parse_address(args.broker), token=config["queue_token"])
+        write_event({'event': 'log', 'message': f"Queue broker listening on {broker.server_address[0]}:{broker.server_address[1]}"})
+        try:
+            broker.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            broker.server_close()
+            work_queue.close()
+        return 0
+
+    # Workers only receive resolved tracks, so they never talk to Spotify.
+    needs_spotify = not (args.worker or args.queue_status)
+    if needs_spotify and (not config["client_id"] or not config["client_secret"]):
+        write_event({'event': 'error', 'message': "Spotify Client ID and Secret are not set (config.json or SPOTIPY_CLIENT_ID/SPOTIPY_CLIENT_SECRET)."})
+        return 2
+
+    cache = MetadataCache(cache_path_for(args.config), ttl_seconds=config["cache_ttl_hours"] * 3600,
+                          max_bytes=config["cache_max_mb"] * 1024 * 1024)
+    downloads = DownloadIndex(download_index_path_for(args.config))
+    try:
+        engine = DownloadEngine(config, cache=cache, downloads=downloads, on_event=write_event)
+    except ValueError as e:
+        write_event({'event': 'error', 'message': str(e)})
+        cache.close()
+        downloads.close()
+        return 2
+
+    def handle_interrupt(signum, frame):
+        # A second Ctrl+C falls through to the default handler and exits at once.
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        write_event({'event': 'log', 'message': "Stopping download..."})
+        engine.stop()
+
+    signal.signal(signal.SIGINT, handle_interrupt)
+
+    work_queue = open_queue(args.queue, config["queue_lease_seconds"], config["queue_token"]) if args.queue else None
+
+    def run_job():
+        if args.worker:
+            return engine.work(work_queue, worker_name())
+        if args.queue_status:
+            return engine.queue_summary(work_queue, args.job)
+        if work_queue is not None:
+            job = engine.enqueue(work_queue, urls)
+            return engine.queue_summary(work_queue, job) if args.no_wait else engine.wait_for_queue(work_queue, job)
+        if resuming:
+            return engine.resume_job(pending=args.resume, failed=args.retry_failed)
+        if args.sync:
+            return engine.sync(urls, prune=args.prune)
+        return engine.run(urls)
+
+    server = None
+    try:
+        try:
+            if needs_spotify:
+                engine.connect()
+        except Exception as e:
+            write_event({'event': 'error', 'message': f"Could not connect to Spotify: {e}"})
+            return 2
+        if config["metrics_port"]:
+            server = serve_metrics(engine.metrics, config["metrics_port"])
+        if args.profile:
+            with profiled(args.profile):
+                summary = run_job()
+            write_event({'event': 'log', 'message': f"Profile written to {args.profile}"})
+        else:
+            summary = run_job()
+    except OSError as e:
+        # e.g. the download directory is missing, read-only or full.
+        write_event({'event': 'error', 'message': str(e)})
+        return 2
+    finally:
+        if server is not None:
+            server.shutdown()
+        if work_queue is not None:
+            work_queue.close()
+        cache.close()
+        downloads.close()
+    if summary is None:
+        return 2
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,78 @@
+import json
+import os
+import sys
+
+from cache import DEFAULT_TTL_HOURS, DEFAULT_MAX_MB
+from matcher import DEFAULT_CANDIDATES
+from media import DEFAULT_OUTPUT_FORMAT
+from workqueue import DEFAULT_LEASE_SECONDS
+
+DEFAULT_CONFIG = {
+    "download_path": "downloads",
+    "quality": "320",
+    "output_format": DEFAULT_OUTPUT_FORMAT,
+    "theme": "dark",
+    "client_id": "",
+    "client_secret": "",
+    "duplicate_handling": "skip",
+    "dedup_fingerprints": False,
+    "cache_ttl_hours": DEFAULT_TTL_HOURS,
+    "cache_max_mb": DEFAULT_MAX_MB,
+    "search_workers": 4,
+    "download_workers": 4,
+    "transcode_workers": os.cpu_count() or 1,
+    "tag_workers": 2,
+    "search_candidates": DEFAULT_CANDIDATES,
+    "cover_cache_dir": "",
+    "cover_max_size": 0,
+    "spotify_rate_limit": 10,
+    "search_rate_limit": 2,
+    "download_rate_limit": 0,
+    "max_retries": 4,
+    "max_download_kbps": 0,
+    "job_max_download_kbps": 0,
+    "max_disk_write_mbps": 0,
+    "budget_path": "",
+    "priority": "",
+    "metrics_file": "",
+    "metrics_port": 0,
+    "queue_lease_seconds": DEFAULT_LEASE_SECONDS,
+    "queue_token": "",
+}
+
+
+def default_config_path():
+    if getattr(sys, 'frozen', False):
+        return os.path.join(os.path.dirname(sys.executable), "config.json")
+    return "config.json"
+
+
+def cache_path_for(config_path):
+    return os.path.join(os.path.dirname(config_path), "cache.sqlite3")
+
+
+def library_index_path_for(config_path):
+    return os.path.join(os.path.dirname(config_path), "library.sqlite3")
+
+
+def download_index_path_for(config_path):
+    return os.path.join(os.path.dirname(config_path), "downloads.sqlite3")
+
+
+def load_config(path):
+    config = dict(DEFAULT_CONFIG)
+    try:
+        with open(path, 'r') as f:
+            config.update(json.load(f))
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    return config
+
+
+def save_config(path, config):
+    # Only what differs from the defaults is written, so a copied config
+    # does not pin machine-specific values like transcode_workers, and
+    # changed defaults still reach existing users.
+    changed = {key: value for key, value in config.items() if key not in DEFAULT_CONFIG or value != DEFAULT_CONFIG[key]}
+    with open(path, 'w') as f:
+        json.dump(changed, f, indent=4)
@@ -0,0 +1,112 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 64
+# Covers are optional, so a failing one is not worth the full retry budget.
+COVER_MAX_RETRIES = 1
+
+
+def shrink_image(data, max_size, quality=90):
+    # Pillow is optional; without it covers are embedded as downloaded.
+    try:
+        from PIL import Image
+    except ImportError:
+        return data
+    with Image.open(io.BytesIO(data)) as image:
+        if max(image.size) <= max_size:
+            return data
+        image = image.convert('RGB')
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+        output = io.BytesIO()
+        image.save(output, format='JPEG', quality=quality, optimize=True)
+    return output.getvalue()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.data = None
+        self.error = None
+
+
+class CoverArtCache:
+    # Each distinct URL is fetched once: concurrent requests for an image that
+    # is already being downloaded wait for that download instead of starting
+    # their own. A URL that failed is not tried again by this cache, so the
+    # other tracks of an album with a dead cover do not each wait on it.
+    def __init__(self, fetch, max_entries=DEFAULT_MAX_ENTRIES, disk_dir=None, max_size=None, quality=90):
+        self.fetch = fetch
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.max_size = max_size
+        self.quality = quality
+        self.fetches = 0
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._failed = {}
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, url):
+        with self._lock:
+            if url in self._entries:
+                self._entries.move_to_end(url)
+                return self._entries[url]
+            if url in self._failed:
+                raise self._failed[url]
+            flight = self._flights.get(url)
+            leader = flight is None
+            if leader:
+                flight = self._flights[url] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.data
+
+        try:
+            flight.data = self._load(url)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if flight.error is None:
+                    self._entries[url] = flight.data
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                else:
+                    self._failed[url] = flight.error
+                del self._flights[url]
+            flight.done.set()
+        return flight.data
+
+    def _disk_path(self, url):
+        key = f"{url}|{self.max_size or 0}"
+        return os.path.join(self.disk_dir, hashlib.sha1(key.encode()).hexdigest() + ".jpg")
+
+    def _load(self, url):
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(url), 'rb') as f:
+                    return f.read()
+            except FileNotFoundError:
+                pass
+
+        self.fetches += 1
+        data = self.fetch(url)
+        if self.max_size:
+            data = shrink_image(data, self.max_size, self.quality)
+
+        if self.disk_dir:
+            path = self._disk_path(url)
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        return data
@@ -0,0 +1,179 @@
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import threading
+
+from library import AUDIO_EXTENSIONS
+from tags import read_ids
+
+# fpcalc reads this many seconds from the start of each file.
+FINGERPRINT_SECONDS = 120
+FINGERPRINT_MATCH = 0.85
+FINGERPRINT_MAX_SHIFT = 16
+FINGERPRINT_DURATION_TOLERANCE = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY, root TEXT NOT NULL, extension TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,
+    track_id TEXT, isrc TEXT, duration REAL, fingerprint TEXT
+);
+CREATE INDEX IF NOT EXISTS files_root ON files (root);
+CREATE INDEX IF NOT EXISTS files_track_id ON files (track_id);
+CREATE INDEX IF NOT EXISTS files_isrc ON files (isrc);
+CREATE INDEX IF NOT EXISTS files_duration ON files (duration);
+"""
+
+
+def compute_fingerprint(path):
+    # Needs Chromaprint's fpcalc on PATH. Returns (duration, [ints]) or None.
+    fpcalc = shutil.which('fpcalc')
+    if fpcalc is None:
+        return None
+    completed = subprocess.run([fpcalc, '-raw', '-json', '-length', str(FINGERPRINT_SECONDS), path], capture_output=True)
+    if completed.returncode != 0:
+        return None
+    try:
+        result = json.loads(completed.stdout)
+    except ValueError:
+        return None
+    if not result.get('fingerprint'):
+        return None
+    return result.get('duration'), result['fingerprint']
+
+
+def fingerprint_similarity(a, b):
+    # Share of equal bits between two raw chromaprints, at the best of a few
+    # small offsets so a shorter intro or a trimmed silence still lines up.
+    best = 0.0
+    for shift in range(-FINGERPRINT_MAX_SHIFT, FINGERPRINT_MAX_SHIFT + 1):
+        pairs = list(zip(a[max(shift, 0):], b[max(-shift, 0):]))
+        if len(pairs) < len(min(a, b, key=len)) // 2:
+            continue
+        errors = sum(bin((x ^ y) & 0xFFFFFFFF).count('1') for x, y in pairs)
+        best = max(best, 1.0 - errors / (32 * len(pairs)))
+    return best
+
+
+def encode_fingerprint(fingerprint):
+    return ",".join(str(value) for value in fingerprint)
+
+
+def decode_fingerprint(text):
+    return [int(value) for value in text.split(",")] if text else []
+
+
+class DownloadIndex:
+    # Maps every audio file in the download directory to the Spotify track ID
+    # and ISRC tagged into it, so a track is recognised whatever its file name
+    # and whichever album, single or compilation it came from. Like
+    # LibraryIndex, files are only re-read when their size or mtime changed.
+    # An empty fingerprint means fpcalc was tried and could not read the file.
+    def __init__(self, db_path):
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def refresh(self, directory, fingerprints=False):
+        # Brings the index up to date with files that predate it or were
+        # changed outside the app. Returns the number of files (re)read.
+        root = os.path.abspath(directory)
+        if not os.path.isdir(root):
+            return 0
+        with self._lock:
+            known = {
+                path: (size, mtime_ns, fingerprint)
+                for path, size, mtime_ns, fingerprint in self._conn.execute("SELECT path, size, mtime_ns, fingerprint FROM files WHERE root = ?", (root,))
+            }
+        seen = set()
+        changed = []
+        with os.scandir(root) as dir_entries:
+            for dir_entry in dir_entries:
+                if not dir_entry.name.lower().endswith(AUDIO_EXTENSIONS) or not dir_entry.is_file():
+                    continue
+                stat = dir_entry.stat()
+                seen.add(dir_entry.path)
+                size, mtime_ns, fingerprint = known.get(dir_entry.path, (None, None, None))
+                if (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns) or (fingerprints and fingerprint is None):
+                    changed.append((dir_entry.path, stat))
+
+        rows = []
+        for path, stat in changed:
+            track_id, isrc = read_ids(path)
+            duration = fingerprint = None
+            if fingerprints:
+                result = compute_fingerprint(path)
+                duration, fingerprint = result if result else (None, [])
+            rows.append(self._row(path, root, stat, track_id, isrc, duration, fingerprint))
+        with self._lock:
+            self._upsert(rows)
+            self._conn.executemany("DELETE FROM files WHERE path = ?", [(path,) for path in known if path not in seen])
+            self._conn.commit()
+        return len(changed)
+
+    def _row(self, path, root, stat, track_id, isrc, duration, fingerprint):
+        extension = os.path.splitext(path)[1].lower()
+        fingerprint = encode_fingerprint(fingerprint) if fingerprint is not None else None
+        return (path, root, extension, stat.st_size, stat.st_mtime_ns, track_id, isrc, duration, fingerprint)
+
+    def _upsert(self, rows):
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO files (path, root, extension, size, mtime_ns, track_id, isrc, duration, fingerprint)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+    def add(self, path, track_id, isrc, duration=None, fingerprint=None):
+        path = os.path.abspath(path)
+        row = self._row(path, os.path.dirname(path), os.stat(path), track_id, isrc, duration, fingerprint)
+        with self._lock:
+            self._upsert([row])
+            self._conn.commit()
+
+    def owner(self, path):
+        # (track_id, isrc) of an indexed file, or (None, None).
+        with self._lock:
+            row = self._conn.execute("SELECT track_id, isrc FROM files WHERE path = ?", (os.path.abspath(path),)).fetchone()
+        return row or (None, None)
+
+    def find(self, track_id, isrc, extension):
+        # Path of an existing file of the same recording, matched on the
+        # Spotify track ID first and the ISRC second.
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path FROM files WHERE extension = ? AND (track_id = ? OR isrc = ?) ORDER BY track_id = ? DESC",
+                (extension, track_id, isrc, track_id),
+            ).fetchall()
+        return self._first_existing(path for (path,) in rows)
+
+    def find_fingerprint(self, fingerprint, duration, extension):
+        # Path of an existing file whose audio matches, or None.
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path, fingerprint FROM files WHERE extension = ? AND fingerprint != '' AND duration BETWEEN ? AND ?",
+                (extension, duration - FINGERPRINT_DURATION_TOLERANCE, duration + FINGERPRINT_DURATION_TOLERANCE),
+            ).fetchall()
+        matches = (path for path, text in rows if fingerprint_similarity(fingerprint, decode_fingerprint(text)) >= FINGERPRINT_MATCH)
+        return self._first_existing(matches)
+
+    def _first_existing(self, paths):
+        # Rows for files deleted since the last refresh are dropped on the way.
+        stale = []
+        found = None
+        for path in paths:
+            if os.path.exists(path):
+                found = path
+                break
+            stale.append((path,))
+        if stale:
+            with self._lock:
+                self._conn.executemany("DELETE FROM files WHERE path = ?", stale)
+                self._conn.commit()
+        return found
@@ -0,0 +1,834 @@
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from budget import PRIORITIES, ByteBudget, shared_budgets
+from covers import COVER_MAX_RETRIES, CoverArtCache
+from dedup import compute_fingerprint
+from journal import JobJournal, journal_path_for, track_key
+from matcher import pick_best, track_query
+from media import OUTPUT_FORMATS, convert_audio, download_format, parse_formats, staged_output_path
+from metrics import RATE_BUCKETS, SIZE_BUCKETS, STATS_INTERVAL, Metrics, run_with_cpu_time, write_atomic, write_job_summary
+from net import HTTP_TIMEOUT, ThreadLocalYoutubeDL, create_session
+from pipeline import Pipeline, Stage, first_line
+from resolver import FETCH_WORKERS, resolve_album, resolve_playlist, resolve_track, stream_playlist
+from scheduler import ScheduledClient, Upstream
+from sync import manifest_path_for, load_manifest, save_manifest, file_entry, relink_moved_files, remove_tracks, prune_files, mark_synced
+from tags import track_fields, write_tags
+from workqueue import INPUT_TIMEOUT, POLL_INTERVAL, new_job_id
+
+
+def sanitize_filename(filename):
+    return "".join(c for c in filename if c not in r'\/:*?"<>|')
+
+
+def parse_spotify_url(url):
+    match = re.search(r"spotify\.com/(playlist|album|track)/([a-zA-Z0-9]+)", url)
+    if match:
+        return match.groups()
+    return None, None
+
+
+def job_priority(name, urls, sync=False):
+    # name is a PRIORITIES key, or "" to pick one from the job: single
+    # tracks go ahead of everything else, syncs run in the background.
+    if name:
+        return PRIORITIES[name]
+    if sync:
+        return PRIORITIES['low']
+    if urls and all(parse_spotify_url(url)[0] == 'track' for url in urls):
+        return PRIORITIES['high']
+    return PRIORITIES['normal']
+
+
+class DownloadEngine:
+    # Everything the GUI and the CLI share. Progress is reported as plain dict
+    # events through on_event, which may be called from worker threads.
+    def __init__(self, config, cache=None, downloads=None, on_event=None, is_paused=None, is_stopped=None):
+        self.config = dict(config)
+        self.formats = parse_formats(self.config["output_format"])
+        self.cache = cache
+        self.downloads = downloads
+        self.claimed_paths = {}
+        self.claim_lock = threading.Lock()
+        self.on_event = on_event or (lambda event: None)
+        self.is_paused = is_paused or threading.Event()
+        self.is_stopped = is_stopped or threading.Event()
+        self.sp = None
+        self.transcode_pool = None
+        self.http = None
+        self.covers = None
+        self.journal = None
+        self.total_tracks = 0
+        self.search_ydl = None
+        self.fetch_ydl = None
+        self.successful_downloads = []
+        self.failed_downloads = []
+        self.metrics = Metrics()
+        self.track_records = []
+        if self.config["priority"] and self.config["priority"] not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {self.config['priority']} (choose from {', '.join(PRIORITIES)})")
+        self.priority = PRIORITIES['normal']
+        # Downloaded bytes count against the machine-wide and this job's
+        # bandwidth caps and, like ffmpeg's output, against the disk budget.
+        bandwidth, self.disk_writes = shared_budgets(self.config["budget_path"])
+        bandwidth.set_rate(self.config["max_download_kbps"] * 1024)
+        self.disk_writes.set_rate(self.config["max_disk_write_mbps"] * 1024 * 1024)
+        self.download_budgets = [bandwidth, ByteBudget(self.config["job_max_download_kbps"] * 1024), self.disk_writes]
+        self.transfer = threading.local()
+        # Every request to Spotify, YouTube search and the media CDN goes
+        # through its Upstream, which rate limits, retries throttled calls and
+        # adapts concurrency. Worker counts are the upper bound.
+        max_retries = self.config["max_retries"]
+        self.spotify_api = Upstream(
+            "spotify", rate=self.config["spotify_rate_limit"] or None, max_concurrency=FETCH_WORKERS,
+            max_retries=max_retries, latency_tolerance=3.0, is_stopped=self.is_stopped, metrics=self.metrics,
+        )
+        self.youtube_search = Upstream(
+            "youtube_search", rate=self.config["search_rate_limit"] or None, max_concurrency=self.config["search_workers"],
+            max_retries=max_retries, latency_tolerance=3.0, is_stopped=self.is_stopped, metrics=self.metrics,
+        )
+        # Download times scale with track length, so latency is no congestion signal here.
+        self.media = Upstream(
+            "media", rate=self.config["download_rate_limit"] or None, max_concurrency=self.config["download_workers"],
+            max_retries=max_retries, is_stopped=self.is_stopped, metrics=self.metrics,
+        )
+        # Cover art comes from another CDN; its errors must not slow downloads.
+        self.cover_art = Upstream(
+            "covers", max_concurrency=self.config["tag_workers"], max_retries=min(max_retries, COVER_MAX_RETRIES),
+            is_stopped=self.is_stopped, metrics=self.metrics,
+        )
+
+    def upstream_stats(self):
+        return [upstream.stats() for upstream in (self.spotify_api, self.youtube_search, self.media, self.cover_art)]
+
+    def emit(self, event, **fields):
+        self.on_event({'event': event, **fields})
+
+    def log(self, message):
+        self.emit('log', message=str(message))
+
+    def connect(self):
+        import spotipy
+        from spotipy.oauth2 import SpotifyClientCredentials
+
+        auth_manager = SpotifyClientCredentials(client_id=self.config["client_id"], client_secret=self.config["client_secret"])
+        # Retries happen in the scheduler, which needs to see the 429s.
+        client = spotipy.Spotify(auth_manager=auth_manager, requests_session=create_session(retries=0))
+        self.sp = ScheduledClient(client, self.spotify_api)
+        self.sp.search(q='test', type='track', limit=1)
+        return self.sp
+
+    def pause(self):
+        self.is_paused.set()
+
+    def resume(self):
+        self.is_paused.clear()
+
+    def stop(self):
+        self.is_stopped.set()
+        self.is_paused.clear()
+
+    def wait_if_paused(self):
+        while self.is_paused.is_set() and not self.is_stopped.is_set():
+            time.sleep(0.2)
+
+    def on_download_progress(self, progress):
+        # yt-dlp calls this after every block it writes, on the downloading
+        # thread, so blocking here throttles or pauses the transfer itself.
+        self.wait_if_paused()
+        if self.is_stopped.is_set():
+            raise InterruptedError("Stopped.")
+        if progress.get('status') != 'downloading':
+            return
+        filename = progress.get('tmpfilename') or progress.get('filename')
+        downloaded = progress.get('downloaded_bytes') or 0
+        if getattr(self.transfer, 'filename', None) != filename:
+            # The first report is the baseline; a resumed .part file starts
+            # at its existing size.
+            self.transfer.filename, self.transfer.downloaded = filename, downloaded
+            return
+        received, self.transfer.downloaded = downloaded - self.transfer.downloaded, downloaded
+        for budget in self.download_budgets:
+            if not budget.consume(received, self.priority, self.is_stopped):
+                raise InterruptedError("Stopped.")
+
+    def resolve(self, url, on_total=None):
+        # Yields lists of tracks; playlists arrive a page at a time.
+        url_type, url_id = parse_spotify_url(url)
+        if not url_type:
+            raise ValueError(f"Not a Spotify track, album or playlist URL: {url}")
+        self.log(f"Fetching {url_type} information...")
+        if url_type == 'playlist':
+            yield from stream_playlist(self.sp, url_id, cache=self.cache, on_total=on_total)
+            return
+        tracks = resolve_album(self.sp, url_id, cache=self.cache) if url_type == 'album' else [resolve_track(self.sp, url_id, cache=self.cache)]
+        if on_total:
+            on_total(len(tracks))
+        yield tracks
+
+    def stream_tasks(self, journal, urls, states=None):
+        # Runs in the pipeline's feeder thread. The first stage's bounded queue
+        # pauses it, so pages are only fetched as fast as tracks are consumed.
+        def add_total(count):
+            self.total_tracks += count
+
+        seen = set()
+        complete = True
+        for url in urls:
+            if self.is_stopped.is_set():
+                complete = False
+                break
+            found = 0
+            try:
+                for tracks in self.resolve(url, on_total=add_total):
+                    found += len(tracks)
+                    for key, track in zip(journal.queue(tracks), tracks):
+                        entry = journal.tracks[key]
+                        if key in seen or (states is not None and entry['state'] not in states):
+                            continue
+                        seen.add(key)
+                        yield self.restore_task(key, track, entry)
+                    if self.is_stopped.is_set():
+                        break
+            except Exception as e:
+                complete = False
+                self.emit('error', url=url, message=str(e))
+                continue
+            self.log(f"Found {found} track(s).")
+            self.emit('resolved', url=url, tracks=found)
+        if complete and not self.is_stopped.is_set():
+            journal.mark_resolved()
+
+    def restore_task(self, key, track_info, entry):
+        task = self.build_track_task(track_info)
+        task['key'] = key
+        # Whatever an earlier run already produced is reused; each stage
+        # checks the file is still there before skipping its work.
+        for field in ('video_id', 'source_path', 'source_codec', 'audio_paths', 'tagged'):
+            if field in entry:
+                task[field] = entry[field]
+        return task
+
+    def run(self, urls):
+        self.priority = job_priority(self.config["priority"], urls)
+        self.begin_job()
+        os.makedirs(self.staging_dir(), exist_ok=True)
+        # A new job replaces the journal of the previous one.
+        journal = JobJournal.create(journal_path_for(self.staging_dir()), urls)
+        self.log("Starting parallel download...")
+        return self.run_job(journal, self.stream_tasks(journal, urls))
+
+    def job_status(self):
+        journal = JobJournal.open(journal_path_for(self.staging_dir()))
+        if journal is None:
+            return None
+        try:
+            return journal.status()
+        finally:
+            journal.close()
+
+    def resume_job(self, pending=True, failed=False):
+        self.begin_job()
+        journal = JobJournal.open(journal_path_for(self.staging_dir()))
+        if journal is None:
+            # No summary: nothing ran, which callers must not mistake for success.
+            self.emit('error', message="There is no interrupted job to resume.")
+            return None
+
+        status = journal.status()
+        self.priority = job_priority(self.config["priority"], journal.urls)
+        if not journal.resolved:
+            # Resolution was cut short: walk the URLs again. Tracks journaled
+            # before the interruption keep their progress.
+            self.log(f"Resuming job: {status['done']} track(s) already done, fetching the remaining tracks...")
+            states = set()
+            if pending:
+                states.update(('queued', 'searched', 'downloaded', 'transcoded', 'tagged'))
+            if failed:
+                states.add('failed')
+            return self.run_job(journal, self.stream_tasks(journal, journal.urls, states))
+
+        entries = (journal.pending() if pending else []) + (journal.failed() if failed else [])
+        tasks = [self.restore_task(key, entry.get('track'), entry) for key, entry in entries]
+        if not pending:
+            self.log(f"Retrying {len(tasks)} failed track(s)...")
+        else:
+            self.log(f"Resuming job: {status['done']} of {status['total']} track(s) already done, {len(tasks)} left.")
+        return self.run_job(journal, tasks)
+
+    def run_job(self, journal, tasks):
+        self.journal = journal
+        self.total_tracks = len(tasks) if isinstance(tasks, list) else 0
+        try:
+            if tasks:
+                try:
+                    self.process(tasks)
+                except Exception as e:
+                    self.emit('error', message=str(e))
+        finally:
+            self.journal = None
+            if journal is not None:
+                journal.close()
+
+        return self.end_job(self.total_tracks)
+
+    def begin_job(self):
+        self.successful_downloads = []
+        self.failed_downloads = []
+        self.track_records = []
+
+    def end_job(self, total, **fields):
+        # Writes the job report and emits the summary every entry point
+        # that runs the pipeline ends with.
+        summary = {'total': total, 'successful': len(self.successful_downloads), 'failed': len(self.failed_downloads), **fields}
+        self.finish_metrics(summary)
+        self.emit('summary', **summary)
+        return summary
+
+    def enqueue(self, work_queue, urls):
+        # Distributed mode, coordinator side: resolves the URLs into a shared
+        # work queue for workers started with work() to lease, as a new job.
+        # Returns the job ID. Workers lease higher priority tracks first.
+        self.priority = job_priority(self.config["priority"], urls)
+        job = new_job_id()
+        pushed = position = 0
+        work_queue.open_input(job)
+        done = threading.Event()
+
+        def renew_input():
+            # Keeps the input open while resolving; workers treat the input
+            # of a coordinator that died as closed once it expires.
+            while not done.wait(INPUT_TIMEOUT / 3):
+                try:
+                    work_queue.renew_input(job)
+                except Exception as e:
+                    self.log(f"Could not renew the queue input: {e}")
+
+        threading.Thread(target=renew_input, daemon=True).start()
+        try:
+            for url in urls:
+                if self.is_stopped.is_set():
+                    break
+                found = 0
+                try:
+                    for tracks in self.resolve(url):
+                        items = []
+                        for track in tracks:
+                            if track:
+                                # The queue is shared by every job, so position keys are per job.
+                                items.append({'key': track_key(track, position, scope=job), 'track': track})
+                            position += 1
+                        found += len(items)
+                        pushed += work_queue.push(items, self.priority, job)
+                except Exception as e:
+                    self.emit('error', url=url, message=str(e))
+                    continue
+                self.log(f"Queued {found} track(s).")
+                self.emit('resolved', url=url, tracks=found)
+        finally:
+            done.set()
+            work_queue.close_input(job)
+        self.log(f"Job {job}: {pushed} track(s) queued for workers.")
+        return job
+
+    def wait_for_queue(self, work_queue, job, interval=POLL_INTERVAL):
+        while not work_queue.drained(job):
+            self.emit('queue', job=job, **work_queue.status(job))
+            if self.is_stopped.wait(interval):
+                break
+        return self.queue_summary(work_queue, job)
+
+    def queue_summary(self, work_queue, job=None):
+        # The Results summary of a distributed job, across every worker; the
+        # queue's latest job by default.
+        if job is None:
+            job = work_queue.latest_job()
+        results = work_queue.results(job)
+        status = work_queue.status(job)
+        self.successful_downloads = [result['name'] for result in results if result['status'] == 'success']
+        self.failed_downloads = [
+            {'track': result['name'], 'artist': result['artist'], 'reason': result.get('reason', ''), 'worker': result.get('worker')}
+            for result in results if result['status'] != 'success'
+        ]
+        workers = {}
+        for result in results:
+            counts = workers.setdefault(result.get('worker'), {'successful': 0, 'failed': 0})
+            counts['successful' if result['status'] == 'success' else 'failed'] += 1
+        summary = {
+            'job': job, 'total': len(results) + status['queued'] + status['leased'], 'successful': len(self.successful_downloads),
+            'failed': len(self.failed_downloads), 'pending': status['queued'] + status['leased'], 'workers': workers,
+        }
+        self.emit('summary', **summary, failures=self.failed_downloads)
+        return summary
+
+    def work(self, work_queue, worker):
+        # Distributed mode, worker side: leases tracks one at a time as the
+        # pipeline has room, keeps the leases of tracks in flight alive and
+        # reports every result back. Returns when the queue is drained or the
+        # engine is stopped; unfinished leases are handed back.
+        self.begin_job()
+        self.total_tracks = 0
+        os.makedirs(self.staging_dir(), exist_ok=True)
+        in_flight = set()
+        lock = threading.Lock()
+        done = threading.Event()
+
+        def renew_leases():
+            interval = max(1.0, self.config["queue_lease_seconds"] / 3)
+            while not done.wait(interval):
+                with lock:
+                    keys = list(in_flight)
+                if keys:
+                    try:
+                        work_queue.renew(worker, keys)
+                    except Exception as e:
+                        self.log(f"Could not renew leases: {e}")
+
+        def leased_tasks():
+            while not self.is_stopped.is_set():
+                try:
+                    items = work_queue.lease(worker, 1)
+                except Exception as e:
+                    # A lease the broker granted but could not confirm expires
+                    # and goes to another worker.
+                    self.log(f"Could not lease a track: {e}")
+                    self.is_stopped.wait(POLL_INTERVAL)
+                    continue
+                if not items:
+                    if work_queue.drained():
+                        return
+                    self.is_stopped.wait(POLL_INTERVAL)
+                    continue
+                for item in items:
+                    task = self.build_track_task(item['track'])
+                    task['lease'] = item['key']
+                    with lock:
+                        in_flight.add(item['key'])
+                    self.total_tracks += 1
+                    yield task
+
+        def report(task):
+            key = task.get('lease')
+            if task['status'] == 'stopped':
+                return
+            result = {'status': task['status'], 'name': task['name'], 'artist': task['artist'], 'path': task.get('final_path'), 'spans': task.get('spans', {})}
+            if task['status'] == 'failure':
+                result['reason'] = first_line(task['reason'])
+            try:
+                if not work_queue.complete(worker, key, result):
+                    self.log(f"-> Lease of {task['name']} had expired; another worker's result is kept.")
+            except Exception as e:
+                # Not retried, as it may have been applied. If it was not,
+                # the lease expires and another worker redoes the track.
+                self.log(f"-> Could not report {task['name']}: {e}")
+            with lock:
+                in_flight.discard(key)
+
+        self.log(f"Worker {worker} started.")
+        threading.Thread(target=renew_leases, daemon=True).start()
+        try:
+            self.process(leased_tasks(), on_task=report)
+        except Exception as e:
+            self.emit('error', message=str(e))
+        finally:
+            done.set()
+            with lock:
+                keys = list(in_flight)
+            if keys:
+                work_queue.release(worker, keys)
+
+        return self.end_job(self.total_tracks, worker=worker)
+
+    def sync(self, urls, prune=False):
+        self.priority = job_priority(self.config["priority"], urls, sync=True)
+        self.begin_job()
+        download_dir = self.config["download_path"]
+        os.makedirs(self.staging_dir(), exist_ok=True)
+
+        playlists = {}
+        tracks_to_process = {}
+        removed_entries = {}
+        for url in urls:
+            if self.is_stopped.is_set():
+                break
+            url_type, playlist_id = parse_spotify_url(url)
+            if url_type != 'playlist':
+                self.emit('error', url=url, message=f"Sync only supports playlist URLs: {url}")
+                continue
+            try:
+                manifest_path = manifest_path_for(download_dir, playlist_id)
+                manifest = load_manifest(manifest_path, playlist_id)
+                snapshot_id = self.sp.playlist(playlist_id, fields='snapshot_id')['snapshot_id']
+                if snapshot_id == manifest['snapshot_id']:
+                    self.emit('sync', url=url, playlist=playlist_id, snapshot_id=snapshot_id, status='unchanged', added=0, removed=0)
+                    continue
+
+                self.log("Fetching playlist information...")
+                tracks = [track for track in resolve_playlist(self.sp, playlist_id, cache=self.cache, snapshot_id=snapshot_id) if track and track.get('id')]
+                relink_moved_files(download_dir, manifest)
+                current_ids = {track['id'] for track in tracks}
+                removed = [track_id for track_id in manifest['tracks'] if track_id not in current_ids]
+                removed_entries.update(remove_tracks(manifest, removed))
+                added = [track for track in tracks if track['id'] not in manifest['tracks']]
+            except Exception as e:
+                self.emit('error', url=url, message=str(e))
+                continue
+
+            playlists[playlist_id] = {'path': manifest_path, 'manifest': manifest, 'snapshot_id': snapshot_id, 'pending': {track['id'] for track in added}}
+            for track in added:
+                tracks_to_process.setdefault(track['id'], track)
+            self.emit('sync', url=url, playlist=playlist_id, snapshot_id=snapshot_id, status='changed', added=len(added), removed=len(removed))
+
+        if prune and removed_entries:
+            # After every playlist is loaded, so a file another playlist in
+            # this sync still lists (or is about to) is kept.
+            prune_files(download_dir, removed_entries, [playlist['manifest'] for playlist in playlists.values()], keep_track_ids=tracks_to_process)
+
+        def record(task):
+            track_id = task.get('track_info', {}).get('id')
+            if task['status'] != 'success' or not track_id:
+                return
+            entry = file_entry(download_dir, task['final_path'])
+            for playlist in playlists.values():
+                if track_id in playlist['pending']:
+                    playlist['manifest']['tracks'][track_id] = entry
+                    playlist['pending'].discard(track_id)
+
+        total_tracks = self.total_tracks = len(tracks_to_process)
+        self.log(f"Found {total_tracks} new track(s). Starting parallel download...")
+        if total_tracks:
+            try:
+                self.process([self.build_track_task(track) for track in tracks_to_process.values()], on_task=record)
+            except Exception as e:
+                self.emit('error', message=str(e))
+
+        for playlist in playlists.values():
+            # Failed tracks keep the old snapshot so the next sync retries them.
+            if not playlist['pending']:
+                mark_synced(playlist['manifest'], playlist['snapshot_id'])
+            save_manifest(playlist['path'], playlist['manifest'])
+
+        return self.end_job(total_tracks)
+
+    def process(self, tasks, on_task=None):
+        if self.downloads is not None:
+            # Picks up files that predate the index or were changed since.
+            refreshed = self.downloads.refresh(self.config["download_path"], fingerprints=self.config["dedup_fingerprints"])
+            if refreshed:
+                self.log(f"Indexed {refreshed} existing file(s) for duplicate detection.")
+        self.claimed_paths = {}
+        self.http = create_session(retries=0)
+        self.covers = CoverArtCache(
+            self.fetch_cover,
+            disk_dir=self.config["cover_cache_dir"] or None,
+            max_size=self.config["cover_max_size"] or None,
+        )
+        self.search_ydl = ThreadLocalYoutubeDL({'quiet': True, 'noplaylist': True, 'extract_flat': 'in_playlist'})
+        self.fetch_ydl = ThreadLocalYoutubeDL({
+            'format': download_format(self.formats),
+            'outtmpl': os.path.join(self.staging_dir(), '%(id)s.%(ext)s'),
+            'quiet': True, 'noplaylist': True, 'progress_hooks': [self.on_download_progress],
+        })
+        try:
+            self.run_pipeline(tasks, on_task)
+        finally:
+            self.search_ydl.close()
+            self.fetch_ydl.close()
+            self.http.close()
+
+    def run_pipeline(self, tasks, on_task):
+        config = self.config
+        with ProcessPoolExecutor(max_workers=config["transcode_workers"]) as self.transcode_pool:
+            pipeline = Pipeline([
+                Stage("search", self.timed("search", self.search_track), config["search_workers"]),
+                Stage("download", self.timed("download", self.fetch_track), config["download_workers"]),
+                Stage("transcode", self.timed("transcode", self.transcode_track), config["transcode_workers"]),
+                Stage("tag", self.timed("tag", self.tag_track), config["tag_workers"]),
+            ], is_paused=self.is_paused, is_stopped=self.is_stopped)
+
+            # Stage stats are reported on a timer rather than as tracks
+            # finish, so queue depths stay live while nothing completes.
+            done = threading.Event()
+
+            def report_periodically():
+                while not done.wait(STATS_INTERVAL):
+                    try:
+                        self.report_stats(pipeline)
+                    except Exception as e:
+                        self.log(f"Could not report stats: {e}")
+
+            reporter = threading.Thread(target=report_periodically, daemon=True)
+            reporter.start()
+            try:
+                for i, task in enumerate(pipeline.run(tasks)):
+                    if task['status'] == 'success':
+                        self.successful_downloads.append(task['name'])
+                        self.checkpoint(task, 'done', final_path=task.get('final_path'))
+                    elif task['status'] == 'failure':
+                        self.log(f"-> Failed: {task['name']}")
+                        self.failed_downloads.append({'track': task['name'], 'artist': task['artist'], 'reason': task['reason']})
+                        self.checkpoint(task, 'failed', reason=first_line(task['reason']))
+                    if on_task:
+                        on_task(task)
+                    self.record_track(task)
+
+                    event = {'status': task['status'], 'name': task['name'], 'artist': task['artist'], 'completed': i + 1, 'total': max(self.total_tracks, i + 1)}
+                    if task['status'] == 'failure':
+                        event['reason'] = first_line(task['reason'])
+                    elif task['status'] == 'success':
+                        event['path'] = task.get('final_path')
+                    self.emit('track', **event)
+            finally:
+                done.set()
+                reporter.join()
+            self.report_stats(pipeline)
+
+    def report_stats(self, pipeline):
+        stages, upstreams = pipeline.stats(), self.upstream_stats()
+        for stage in stages:
+            for field in ('queue_depth', 'busy', 'utilization'):
+                self.metrics.set_gauge(f"stage_{field}", stage[field], stage=stage['stage'])
+        for upstream in upstreams:
+            for field in ('limit', 'in_flight'):
+                self.metrics.set_gauge(f"upstream_{field}", upstream[field], upstream=upstream['upstream'])
+        self.write_prometheus_file()
+        self.emit('stats', stages=stages, upstreams=upstreams)
+
+    def timed(self, name, func):
+        def run(task):
+            with self.metrics.span(name, task):
+                return func(task)
+        return run
+
+    def record_track(self, task):
+        self.metrics.incr('tracks_total', status=task['status'])
+        self.track_records.append({
+            'name': task['name'], 'artist': task['artist'], 'status': task['status'],
+            'path': task.get('final_path'), 'spans': task.get('spans', {}),
+        })
+
+    def write_prometheus_file(self):
+        # For node_exporter's textfile collector and the like.
+        if self.config["metrics_file"]:
+            write_atomic(self.config["metrics_file"], self.metrics.prometheus_text())
+
+    def finish_metrics(self, summary):
+        self.write_prometheus_file()
+        settings = {key: self.config[key] for key in (
+            'output_format', 'quality', 'search_workers', 'download_workers', 'transcode_workers', 'tag_workers',
+            'spotify_rate_limit', 'search_rate_limit', 'download_rate_limit',
+        )}
+        report = {'summary': summary, 'settings': settings, 'metrics': self.metrics.snapshot(), 'tracks': self.track_records}
+        try:
+            path = write_job_summary(self.config["download_path"], report)
+        except OSError as e:
+            self.log(f"Could not write the job summary: {e}")
+            return
+        stages = [histogram for histogram in report['metrics']['histograms'] if histogram['name'].endswith('_seconds') and not histogram['labels']]
+        self.emit('metrics', path=path, histograms=stages)
+
+    def staging_dir(self):
+        return os.path.join(self.config["download_path"], ".partial")
+
+    def checkpoint(self, task, state, **fields):
+        if self.journal is not None and 'key' in task:
+            self.journal.record(task['key'], state, **fields)
+
+    def build_track_task(self, track_info):
+        if not track_info:
+            return {'status': 'failure', 'name': 'Unavailable', 'artist': '', 'reason': 'Track data is null.'}
+        task = {'track_info': track_info, 'name': track_info['name'], 'artist': track_info['artists'][0]['name']}
+        sanitized_track_name = sanitize_filename(task['name'])
+        sanitized_artist_name = sanitize_filename(task['artist'])
+        task['final_paths'] = [
+            os.path.join(self.config["download_path"], f"{sanitized_artist_name} - {sanitized_track_name}{OUTPUT_FORMATS[output_format]['ext']}")
+            for output_format in self.formats
+        ]
+        task['final_path'] = task['final_paths'][0]
+        return task
+
+    def converted(self, task):
+        # True when a resumed task already has every configured format staged.
+        audio_paths = task.get('audio_paths') or []
+        extensions = [OUTPUT_FORMATS[output_format]['ext'] for output_format in self.formats]
+        return [os.path.splitext(path)[1] for path in audio_paths] == extensions and all(os.path.exists(path) for path in audio_paths)
+
+    def track_ids(self, task):
+        track_info = task['track_info']
+        return track_info.get('id'), (track_info.get('external_ids') or {}).get('isrc')
+
+    def path_taken(self, path, track_id, isrc):
+        # True when path belongs to a different recording, either earlier in
+        # this job or in the download index. Untagged files count as ours.
+        if path in self.claimed_paths:
+            return self.claimed_paths[path] != track_id
+        if self.downloads is None or not os.path.exists(path):
+            return False
+        owner_id, owner_isrc = self.downloads.owner(path)
+        if not owner_id and not owner_isrc:
+            return False
+        return owner_id != track_id and not (isrc and owner_isrc == isrc)
+
+    def claim_paths(self, task):
+        # Different tracks can sanitize to the same file name. Instead of
+        # overwriting each other, later ones get the album, then the track ID
+        # appended.
+        track_id, isrc = self.track_ids(task)
+        album = sanitize_filename(task['track_info']['album']['name'])
+        stems_and_extensions = [os.path.splitext(path) for path in task['final_paths']]
+        with self.claim_lock:
+            for suffix in ("", f" ({album})", f" [{track_id}]"):
+                paths = [f"{stem}{suffix}{extension}" for stem, extension in stems_and_extensions]
+                if not any(self.path_taken(path, track_id, isrc) for path in paths):
+                    break
+            for path in paths:
+                self.claimed_paths[path] = track_id
+        task['final_paths'] = paths
+        task['final_path'] = paths[0]
+
+    def find_existing(self, task):
+        # Existing files of this recording in every configured format, found
+        # by Spotify ID or ISRC whatever they are named, or None.
+        if self.downloads is None:
+            return None
+        track_id, isrc = self.track_ids(task)
+        existing = [self.downloads.find(track_id, isrc, OUTPUT_FORMATS[output_format]['ext']) for output_format in self.formats]
+        return existing if all(existing) else None
+
+    def skip_duplicate(self, task, paths):
+        self.log(f"-> Skipping duplicate: {task['name']}")
+        task['final_paths'] = paths
+        task['final_path'] = paths[0]
+        task['status'] = 'success'
+        return task
+
+    def search_track(self, task):
+        self.claim_paths(task)
+        handling_mode = self.config["duplicate_handling"]
+        if handling_mode == "skip":
+            existing = self.find_existing(task)
+            if existing:
+                return self.skip_duplicate(task, existing)
+        if all(os.path.exists(path) for path in task['final_paths']):
+            if handling_mode == "skip":
+                return self.skip_duplicate(task, task['final_paths'])
+            elif handling_mode == "overwrite":
+                self.log(f"-> Overwriting: {task['name']}")
+
+        track_id = task['track_info'].get('id')
+        youtube_key = f"youtube:{track_id}" if track_id and self.cache is not None else None
+        if not task.get('video_id') and youtube_key:
+            task['video_id'] = self.cache.get(youtube_key)
+        if not task.get('video_id'):
+            self.log(f"-> Searching: {task['name']}")
+            search_query = f"{task['artist']} - {task['name']} audio"
+            # One flat search returns metadata for every candidate; only the
+            # best-scoring one is downloaded.
+            candidates = self.config["search_candidates"]
+            info = self.youtube_search.call(self.search_ydl.get().extract_info, f"ytsearch{candidates}:{search_query}", download=False)
+            entries = [entry for entry in info.get('entries') or [] if entry]
+            if not entries:
+                raise ValueError(f"No YouTube results for '{search_query}'.")
+            best, score = pick_best(track_query(task['track_info']), entries)
+            if best is None:
+                raise ValueError(f"No close YouTube match for '{search_query}' (best score {score:.2f}).")
+            task['video_id'] = best['id']
+            if youtube_key:
+                self.cache.set(youtube_key, task['video_id'])
+        self.checkpoint(task, 'searched', video_id=task['video_id'])
+        return task
+
+    def fetch_track(self, task):
+        # source_path and audio_paths are only set here for a resumed task.
+        if self.converted(task) or (task.get('source_path') and os.path.exists(task['source_path'])):
+            return task
+        # yt-dlp continues an interrupted download from its .part file.
+        ydl = self.fetch_ydl.get()
+        started = time.perf_counter()
+        info = self.media.call(ydl.extract_info, f"https://www.youtube.com/watch?v={task['video_id']}", download=True)
+        seconds = time.perf_counter() - started
+        task['source_path'] = ydl.prepare_filename(info)
+        size = os.path.getsize(task['source_path']) if os.path.exists(task['source_path']) else 0
+        if size:
+            self.metrics.observe('download_bytes', size, buckets=SIZE_BUCKETS)
+            self.metrics.observe('download_bytes_per_second', size / max(seconds, 1e-6), buckets=RATE_BUCKETS)
+            task.setdefault('spans', {})['download_bytes'] = size
+        task['source_codec'] = info.get('acodec')
+        self.checkpoint(task, 'downloaded', source_path=task['source_path'], source_codec=task['source_codec'])
+        return task
+
+    def transcode_track(self, task):
+        if self.converted(task):
+            return task
+        # Passthrough formats are remuxed without re-encoding when the source
+        # codec allows it; all formats come from a single decode.
+        outputs = [(output_format, staged_output_path(self.staging_dir(), task['video_id'], output_format)) for output_format in self.formats]
+        future = self.transcode_pool.submit(run_with_cpu_time, convert_audio, task['source_path'], outputs, task.get('source_codec'), self.config["quality"])
+        task['audio_paths'], cpu_seconds = future.result()
+        # ffmpeg cannot be throttled while it runs, so its output is charged
+        # afterwards and holds back the next transcode instead.
+        written = sum(os.path.getsize(path) for path in task['audio_paths'])
+        if not self.disk_writes.consume(written, self.priority, self.is_stopped):
+            raise InterruptedError("Stopped.")
+        self.metrics.observe('transcode_cpu_seconds', cpu_seconds)
+        task.setdefault('spans', {})['transcode_cpu'] = round(cpu_seconds, 4)
+        self.checkpoint(task, 'transcoded', audio_paths=task['audio_paths'])
+        return task
+
+    def tag_track(self, task):
+        duration = fingerprint = None
+        if task.get('tagged') and all(os.path.exists(path) for path in task['audio_paths']):
+            # Resumed after the tags were written; only the move is left.
+            return self.place_track(task, duration, fingerprint)
+        if self.downloads is not None and self.config["dedup_fingerprints"]:
+            result = compute_fingerprint(task['audio_paths'][0])
+            if result:
+                duration, fingerprint = result
+                if self.config["duplicate_handling"] == "skip":
+                    # Catches copies the tags cannot, e.g. files from before the index.
+                    existing = [
+                        self.downloads.find_fingerprint(fingerprint, duration, os.path.splitext(path)[1])
+                        for path in task['final_paths']
+                    ]
+                    if all(existing):
+                        for audio_path in task['audio_paths']:
+                            os.remove(audio_path)
+                        return self.skip_duplicate(task, existing)
+        self.embed_metadata(task['audio_paths'], task['track_info'])
+        task['tagged'] = True
+        self.checkpoint(task, 'tagged', tagged=True)
+        return self.place_track(task, duration, fingerprint)
+
+    def place_track(self, task, duration, fingerprint):
+        track_id, isrc = self.track_ids(task)
+        for audio_path, final_path in zip(task['audio_paths'], task['final_paths']):
+            os.replace(audio_path, final_path)
+            if self.downloads is not None:
+                self.downloads.add(final_path, track_id, isrc, duration=duration, fingerprint=fingerprint)
+        self.log(f"-> Downloaded & tagged: {task['name']}")
+        task['status'] = 'success'
+        return task
+
+    def fetch_cover(self, url):
+        # Only cache misses get here, so cover_fetch_seconds is network time.
+        def get():
+            response = self.http.get(url, timeout=HTTP_TIMEOUT)
+            response.raise_for_status()
+            return response.content
+        with self.metrics.span('cover_fetch'):
+            return self.cover_art.call(get)
+
+    def embed_metadata(self, file_paths, track_info):
+        images = track_info['album']['images']
+        cover = None
+        if images:
+            try:
+                cover = self.covers.get(images[0]['url'])
+            except Exception:
+                pass
+        fields = track_fields(track_info)
+        for file_path in file_paths:
+            write_tags(file_path, fields, cover)
@@ -0,0 +1,124 @@
+import json
+import os
+import threading
+import time
+
+JOURNAL_NAME = "job.jsonl"
+TERMINAL_STATES = ('done', 'failed')
+
+
+def journal_path_for(staging_dir):
+    return os.path.join(staging_dir, JOURNAL_NAME)
+
+
+def track_key(track_info, index, scope=""):
+    # Local playlist files have no Spotify ID, so fall back to the position,
+    # prefixed with scope where keys from several jobs share one namespace.
+    return track_info.get('id') or f"{scope}#{index}"
+
+
+class JobJournal:
+    # Write-ahead log of a download job, one JSON record per line. Every track
+    # is journaled with its full metadata when queued and then with each state
+    # it reaches (searched, downloaded, transcoded, tagged, done, failed) plus the
+    # fields that state produced, so a restarted job needs no Spotify calls
+    # once its URLs were fully resolved, and skips every step that already
+    # finished. A crash can only tear the last line, which replay ignores.
+    # Metadata is only kept in memory for tracks a resume still needs.
+    def __init__(self, path, mode):
+        self.path = path
+        self.tracks = {}
+        self.urls = []
+        self.resolved = False
+        self.position = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if mode == 'a':
+            self._replay()
+        self._file = open(path, mode, encoding='utf-8')
+
+    @classmethod
+    def create(cls, path, urls):
+        journal = cls(path, 'w')
+        journal.urls = list(urls)
+        journal._write({'job': {'urls': journal.urls, 'created_at': time.time()}})
+        return journal
+
+    @classmethod
+    def open(cls, path):
+        if not os.path.exists(path):
+            return None
+        return cls(path, 'a')
+
+    def _replay(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if 'job' in record:
+                    self.urls = record['job']['urls']
+                    continue
+                if 'resolved' in record:
+                    self.resolved = True
+                    continue
+                entry = self.tracks.setdefault(record.pop('key'), {})
+                entry.update(record)
+                if entry['state'] == 'done':
+                    entry.pop('track', None)
+
+    def _write(self, record):
+        line = json.dumps(record, separators=(',', ':')) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def queue(self, tracks):
+        # Tracks already journaled keep their state, so re-resolving the URLs
+        # of a job that was interrupted during resolution is safe.
+        keys = []
+        lines = []
+        for track_info in tracks:
+            key = track_key(track_info or {}, self.position)
+            self.position += 1
+            keys.append(key)
+            if key not in self.tracks:
+                self.tracks[key] = {'state': 'queued'}
+                lines.append(json.dumps({'key': key, 'state': 'queued', 'track': track_info}, separators=(',', ':')))
+        if lines:
+            with self._lock:
+                self._file.write("".join(line + "\n" for line in lines))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+        return keys
+
+    def mark_resolved(self):
+        self.resolved = True
+        self._write({'resolved': True})
+
+    def record(self, key, state, **fields):
+        entry = self.tracks.setdefault(key, {})
+        entry.update(fields, state=state)
+        if state == 'done':
+            entry.pop('track', None)
+        self._write({'key': key, 'state': state, **fields})
+
+    def pending(self):
+        return [(key, entry) for key, entry in self.tracks.items() if entry['state'] not in TERMINAL_STATES]
+
+    def failed(self):
+        return [(key, entry) for key, entry in self.tracks.items() if entry['state'] == 'failed']
+
+    def status(self):
+        counts = {'total': len(self.tracks), 'done': 0, 'failed': 0}
+        for entry in self.tracks.values():
+            if entry['state'] in TERMINAL_STATES:
+                counts[entry['state']] += 1
+        counts['pending'] = counts['total'] - counts['done'] - counts['failed']
+        return counts
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,191 @@
+import os
+import re
+import sqlite3
+import threading
+
+AUDIO_EXTENSIONS = (".mp3", ".m4a", ".opus")
+PRELOAD_BATCH_SIZE = 2000
+ENTRIES_QUERY = "SELECT rowid, path, filename, mtime_ns, duration, artist, title, album FROM tracks WHERE root = ? ORDER BY mtime_ns DESC"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    path TEXT PRIMARY KEY, root TEXT NOT NULL, filename TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,
+    duration REAL, artist TEXT NOT NULL DEFAULT '', title TEXT NOT NULL DEFAULT '', album TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS tracks_root ON tracks (root);
+CREATE INDEX IF NOT EXISTS tracks_root_mtime ON tracks (root, mtime_ns DESC);
+CREATE TABLE IF NOT EXISTS roots (root TEXT PRIMARY KEY, dir_mtime_ns INTEGER NOT NULL);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5(artist, title, album, filename, content='tracks');
+CREATE TRIGGER IF NOT EXISTS tracks_ai AFTER INSERT ON tracks BEGIN
+    INSERT INTO tracks_fts(rowid, artist, title, album, filename) VALUES (new.rowid, new.artist, new.title, new.album, new.filename);
+END;
+CREATE TRIGGER IF NOT EXISTS tracks_ad AFTER DELETE ON tracks BEGIN
+    INSERT INTO tracks_fts(tracks_fts, rowid, artist, title, album, filename) VALUES ('delete', old.rowid, old.artist, old.title, old.album, old.filename);
+END;
+CREATE TRIGGER IF NOT EXISTS tracks_au AFTER UPDATE ON tracks BEGIN
+    INSERT INTO tracks_fts(tracks_fts, rowid, artist, title, album, filename) VALUES ('delete', old.rowid, old.artist, old.title, old.album, old.filename);
+    INSERT INTO tracks_fts(rowid, artist, title, album, filename) VALUES (new.rowid, new.artist, new.title, new.album, new.filename);
+END;
+"""
+
+
+def parse_filename(filename):
+    stem = os.path.splitext(filename)[0]
+    artist, separator, title = stem.partition(" - ")
+    if not separator:
+        return "", stem
+    return artist, title
+
+
+def read_tags(path):
+    artist, title = parse_filename(os.path.basename(path))
+    fields = {'artist': artist, 'title': title, 'album': "", 'duration': None}
+    try:
+        import mutagen
+        audio = mutagen.File(path, easy=True)
+    except Exception:
+        return fields
+    if audio is None:
+        return fields
+    fields['duration'] = getattr(audio.info, 'length', None)
+    tags = audio.tags or {}
+    for key in ('artist', 'title', 'album'):
+        values = tags.get(key)
+        if values:
+            fields[key] = values[0]
+    return fields
+
+
+class LibraryIndex:
+    # Persistent index of the download directory. Files are only re-read with
+    # mutagen when their size or mtime changed, and an unchanged directory
+    # mtime skips the directory scan altogether. The database must live
+    # outside the indexed directory, or its own writes would bump that mtime.
+    def __init__(self, db_path):
+        self.root = None
+        self.entries = []
+        self.fts = False
+        self._lock = threading.Lock()
+        self._last_query = None
+        self._last_results = []
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        try:
+            self._conn.executescript(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            # SQLite builds without FTS5 fall back to substring search.
+            self.fts = False
+        # Searches run on the UI thread and use their own connection, so they
+        # never wait for a scan that holds the write lock.
+        self._search_conn = sqlite3.connect(db_path, check_same_thread=False)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+            self._search_conn.close()
+
+    def scan(self, directory, force=False):
+        root = os.path.abspath(directory)
+        with self._lock:
+            if root != self.root:
+                self.root, self.entries = root, []
+            if not os.path.isdir(root):
+                self.entries = []
+                return self.entries
+            dir_mtime_ns = os.stat(root).st_mtime_ns
+            stored = self._conn.execute("SELECT dir_mtime_ns FROM roots WHERE root = ?", (root,)).fetchone()
+            if force or not stored or stored[0] != dir_mtime_ns:
+                self._sync_files()
+                self._conn.execute("INSERT OR REPLACE INTO roots (root, dir_mtime_ns) VALUES (?, ?)", (root, dir_mtime_ns))
+                self._conn.commit()
+                self.entries = self._load_entries()
+            elif not self.entries:
+                self.entries = self._load_entries()
+            self._last_query = None
+            return self.entries
+
+    def preload(self, directory, batch_size=PRELOAD_BATCH_SIZE):
+        # Fills self.entries from the index alone, newest first, yielding
+        # after each batch so the first screenful can be drawn before the
+        # rest is loaded. scan() then only reloads if the folder changed.
+        root = os.path.abspath(directory)
+        with self._lock:
+            if root == self.root and self.entries:
+                return
+            self.root, self.entries = root, []
+            cursor = self._conn.execute(ENTRIES_QUERY, (root,))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                self.entries = self.entries + [self._entry(row) for row in rows]
+                self._last_query = None
+                yield len(self.entries)
+
+    def _sync_files(self):
+        known = {
+            path: (size, mtime_ns)
+            for path, size, mtime_ns in self._conn.execute("SELECT path, size, mtime_ns FROM tracks WHERE root = ?", (self.root,))
+        }
+        seen = set()
+        changed = []
+        with os.scandir(self.root) as dir_entries:
+            for dir_entry in dir_entries:
+                if not dir_entry.name.lower().endswith(AUDIO_EXTENSIONS) or not dir_entry.is_file():
+                    continue
+                stat = dir_entry.stat()
+                seen.add(dir_entry.path)
+                if known.get(dir_entry.path) != (stat.st_size, stat.st_mtime_ns):
+                    changed.append((dir_entry.path, dir_entry.name, stat))
+
+        rows = []
+        for path, filename, stat in changed:
+            tags = read_tags(path)
+            rows.append((path, self.root, filename, stat.st_size, stat.st_mtime_ns, tags['duration'], tags['artist'], tags['title'], tags['album']))
+        self._conn.executemany(
+            "INSERT INTO tracks (path, root, filename, size, mtime_ns, duration, artist, title, album) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT(path) DO UPDATE SET root = excluded.root, filename = excluded.filename, size = excluded.size, mtime_ns = excluded.mtime_ns,"
+            " duration = excluded.duration, artist = excluded.artist, title = excluded.title, album = excluded.album",
+            rows,
+        )
+        self._conn.executemany("DELETE FROM tracks WHERE path = ?", [(path,) for path in known if path not in seen])
+        self._conn.commit()
+        return len(changed)
+
+    def _entry(self, row):
+        rowid, path, filename, mtime_ns, duration, artist, title, album = row
+        return {
+            'rowid': rowid, 'path': path, 'filename': filename, 'mtime': mtime_ns / 1e9, 'duration': duration,
+            'artist': artist, 'title': title, 'album': album,
+            'search_text': " ".join((filename, artist, title, album)).lower(),
+        }
+
+    def _load_entries(self):
+        return [self._entry(row) for row in self._conn.execute(ENTRIES_QUERY, (self.root,))]
+
+    def search(self, query):
+        query = query.lower()
+        terms = query.split()
+        if not terms:
+            return self.entries
+        if self.fts:
+            tokens = re.findall(r"\w+", query)
+            if not tokens:
+                return self.entries
+            match = " AND ".join(f'"{token}"*' for token in tokens)
+            rowids = {rowid for (rowid,) in self._search_conn.execute("SELECT rowid FROM tracks_fts WHERE tracks_fts MATCH ?", (match,))}
+            return [entry for entry in self.entries if entry['rowid'] in rowids]
+
+        # Typing usually extends the previous query, whose matches are a superset.
+        candidates = self.entries
+        if self._last_query and query.startswith(self._last_query):
+            candidates = self._last_results
+        results = [entry for entry in candidates if all(term in entry['search_text'] for term in terms)]
+        self._last_query, self._last_results = query, results
+        return results
@@ -0,0 +1,112 @@
+import re
+import unicodedata
+from difflib import SequenceMatcher
+
+DEFAULT_CANDIDATES = 5
+MIN_MATCH_SCORE = 0.45
+
+WEIGHTS = {'duration': 0.4, 'title': 0.3, 'artist': 0.2, 'channel': 0.1}
+
+# Words that describe the video rather than the song.
+NOISE_WORDS = {
+    'official', 'audio', 'video', 'music', 'lyrics', 'lyric', 'visualizer', 'hd', 'hq', '4k', 'mv',
+    'feat', 'ft', 'featuring', 'with', 'the', 'a', 'and', 'topic', 'vevo', 'explicit', 'clean', 'version',
+    'remaster', 'remastered',
+}
+
+# A candidate naming one of these when the Spotify title does not is a
+# different recording of the song.
+VARIANT_WORDS = {
+    'live', 'cover', 'remix', 'karaoke', 'instrumental', 'acoustic', 'sped', 'slowed', 'reverb',
+    'nightcore', '8d', 'mashup', 'edit', 'extended', 'reaction', 'tutorial', 'piano', 'bass', 'boosted',
+}
+
+FEATURE_PATTERN = re.compile(r"\b(?:ft|feat|featuring)\b\.?\s+([^()\[\]|]+)")
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return text.lower()
+
+
+def tokens(text):
+    return [token for token in re.findall(r"\w+", normalize(text)) if token not in NOISE_WORDS]
+
+
+def coverage(expected, text):
+    # Share of the expected tokens that appear in text, so extra words in a
+    # video title (channel names, "official video") do not count against it.
+    expected = set(expected)
+    if not expected:
+        return 0.0
+    found = set(tokens(text))
+    return len(expected & found) / len(expected)
+
+
+def duration_score(expected_seconds, candidate_seconds):
+    if not expected_seconds or not candidate_seconds:
+        return 0.5
+    delta = abs(candidate_seconds - expected_seconds)
+    if delta <= 2:
+        return 1.0
+    # Music videos often add an intro or outro, so the falloff is gradual.
+    return max(0.0, 1.0 - (delta - 2) / 30)
+
+
+def channel_score(artists, candidate):
+    channel = candidate.get('channel') or candidate.get('uploader') or ""
+    score = 0.0
+    if channel.endswith(" - Topic"):
+        # Auto-generated "Artist - Topic" channels carry the studio release.
+        score = 1.0
+    elif artists and coverage(tokens(artists[0]), channel.replace('VEVO', '')) == 1.0:
+        score = 0.8
+    if candidate.get('channel_is_verified'):
+        score = max(score, 0.5)
+    return score
+
+
+def score_candidate(track, candidate):
+    # track: {'name', 'artists': [names], 'duration_ms'}; candidate: an entry
+    # from a flat yt-dlp search. Returns (score, breakdown).
+    title = candidate.get('title') or ""
+    channel = candidate.get('channel') or candidate.get('uploader') or ""
+    name_tokens = tokens(track['name'])
+    artist_tokens = [token for artist in track['artists'] for token in tokens(artist)]
+
+    title_score = coverage(name_tokens, title)
+    if name_tokens and title_score < 1.0:
+        # Partial credit for spelling differences the token match misses.
+        title_score = max(title_score, SequenceMatcher(None, " ".join(name_tokens), " ".join(tokens(title))).ratio() * 0.8)
+    breakdown = {
+        'duration': duration_score((track.get('duration_ms') or 0) / 1000, candidate.get('duration')),
+        'title': title_score,
+        'artist': coverage(artist_tokens, f"{title} {channel}"),
+        'channel': channel_score(track['artists'], candidate),
+    }
+    score = sum(WEIGHTS[key] * value for key, value in breakdown.items())
+
+    unexpected = (set(tokens(title)) & VARIANT_WORDS) - set(name_tokens)
+    # A featured artist Spotify does not list points to another version.
+    known = set(name_tokens) | set(artist_tokens)
+    guests = [match for match in FEATURE_PATTERN.findall(normalize(title)) if not set(tokens(match)) <= known]
+    breakdown['variant_penalty'] = 0.25 * (len(unexpected) + len(guests))
+    return score - breakdown['variant_penalty'], breakdown
+
+
+def pick_best(track, candidates, min_score=MIN_MATCH_SCORE):
+    # Returns (candidate, score) for the best candidate, or (None, best_score)
+    # when nothing scores at least min_score.
+    best, best_score = None, float('-inf')
+    for candidate in candidates:
+        score, _ = score_candidate(track, candidate)
+        if score > best_score:
+            best, best_score = candidate, score
+    if best is None or best_score < min_score:
+        return None, best_score
+    return best, best_score
+
+
+def track_query(track):
+    return {'name': track['name'], 'artists': [artist['name'] for artist in track['artists']], 'duration_ms': track.get('duration_ms')}
@@ -0,0 +1,72 @@
+import os
+import shutil
+import subprocess
+
+# copy_codecs: source codecs that can be remuxed into the container as-is.
+OUTPUT_FORMATS = {
+    'mp3': {'ext': '.mp3', 'muxer': 'mp3', 'encoder': 'libmp3lame', 'copy_codecs': ()},
+    'm4a': {'ext': '.m4a', 'muxer': 'ipod', 'encoder': 'aac', 'copy_codecs': ('mp4a', 'aac')},
+    'opus': {'ext': '.opus', 'muxer': 'opus', 'encoder': 'libopus', 'copy_codecs': ('opus',)},
+}
+DEFAULT_OUTPUT_FORMAT = "mp3"
+
+
+def find_ffmpeg():
+    # A PATH lookup instead of running "ffmpeg -version", which costs a
+    # process start (and an antivirus scan on Windows) at every launch.
+    return shutil.which('ffmpeg')
+
+
+def staged_output_path(staging_dir, video_id, output_format):
+    # yt-dlp saves the source as <video_id>.<ext> in the same folder, so the
+    # outputs get their own suffix; an m4a output would otherwise overwrite
+    # an m4a source and be deleted with it.
+    return os.path.join(staging_dir, f"{video_id}.out{OUTPUT_FORMATS[output_format]['ext']}")
+
+
+def parse_formats(value):
+    formats = [name.strip().lower() for name in str(value).split(',') if name.strip()]
+    unknown = [name for name in formats if name not in OUTPUT_FORMATS]
+    if unknown:
+        raise ValueError(f"Unknown output format: {', '.join(unknown)} (choose from {', '.join(OUTPUT_FORMATS)})")
+    return list(dict.fromkeys(formats)) or [DEFAULT_OUTPUT_FORMAT]
+
+
+def download_format(formats):
+    # With a single passthrough format, prefer a source that can be copied.
+    if formats == ['m4a']:
+        return 'bestaudio[ext=m4a]/bestaudio/best'
+    if formats == ['opus']:
+        return 'bestaudio[acodec=opus]/bestaudio/best'
+    return 'bestaudio/best'
+
+
+def can_copy(output_format, source_codec):
+    copy_codecs = OUTPUT_FORMATS[output_format]['copy_codecs']
+    return bool(source_codec and copy_codecs) and source_codec.lower().startswith(copy_codecs)
+
+
+def convert_audio(source_path, outputs, source_codec, quality):
+    # Runs inside a worker process, so it must stay a picklable module-level function.
+    # outputs is a list of (format, path). All of them come from one ffmpeg
+    # run, so the source is decoded once however many encoders it feeds, and
+    # not at all when every output is a remux. Each output only appears under
+    # its final name once complete, so a resumed job can trust any file it
+    # finds there.
+    command = ['ffmpeg', '-y', '-hide_banner', '-loglevel', 'error', '-i', source_path]
+    for output_format, output_path in outputs:
+        spec = OUTPUT_FORMATS[output_format]
+        command += ['-map', '0:a:0', '-vn']
+        if can_copy(output_format, source_codec):
+            command += ['-codec:a', 'copy']
+        else:
+            command += ['-codec:a', spec['encoder'], '-b:a', f"{quality}k"]
+        command += ['-f', spec['muxer'], output_path + ".tmp"]
+    completed = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.decode(errors='replace').strip() or f"ffmpeg exited with {completed.returncode}")
+    for _, output_path in outputs:
+        os.replace(output_path + ".tmp", output_path)
+    if source_path not in [output_path for _, output_path in outputs]:
+        os.remove(source_path)
+    return [output_path for _, output_path in outputs]
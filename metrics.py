@@ -0,0 +1,249 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+METRIC_PREFIX = "spotify_downloader_"
+METRICS_DIR = ".metrics"
+# Seconds between stage stats reports, which also rewrite the metrics file.
+STATS_INTERVAL = 1.0
+
+# Upper bounds, Prometheus style: an observation lands in the first bucket it
+# does not exceed.
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+RATE_BUCKETS = tuple(2 ** power * 1024 for power in range(4, 17))
+SIZE_BUCKETS = tuple(2 ** power * 1024 for power in range(6, 17))
+
+
+class Histogram:
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        # Interpolated within the bucket, like Prometheus' histogram_quantile,
+        # and clamped to the observed range.
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                value = lower + (upper - lower) * (rank - seen) / count
+                return min(max(value, self.min), self.max)
+            seen += count
+        return self.max
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+        }
+
+
+class Metrics:
+    # Thread-safe counters, gauges and histograms, keyed by name and labels.
+    def __init__(self):
+        self.started_at = time.time()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def incr(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, buckets=TIME_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def span(self, name, task=None):
+        # Times the block into the "<name>_seconds" histogram and, given a
+        # task, into task['spans'] for the per-track breakdown.
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            self.observe(f"{name}_seconds", seconds)
+            if task is not None:
+                task.setdefault('spans', {})[name] = round(seconds, 4)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'started_at': self.started_at,
+                'elapsed': time.time() - self.started_at,
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in sorted(self._counters.items())],
+                'gauges': [{'name': name, 'labels': dict(labels), 'value': value} for (name, labels), value in sorted(self._gauges.items())],
+                'histograms': [
+                    {'name': name, 'labels': dict(labels), **histogram.summary()}
+                    for (name, labels), histogram in sorted(self._histograms.items())
+                ],
+            }
+
+    def prometheus_text(self):
+        lines = []
+
+        def series(name, labels, extra=()):
+            pairs = [*labels, *extra]
+            if not pairs:
+                return METRIC_PREFIX + name
+            return METRIC_PREFIX + name + "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+        with self._lock:
+            typed = set()
+            for kind, metrics in (('counter', self._counters), ('gauge', self._gauges)):
+                for (name, labels), value in sorted(metrics.items()):
+                    if name not in typed:
+                        typed.add(name)
+                        lines.append(f"# TYPE {METRIC_PREFIX}{name} {kind}")
+                    lines.append(f"{series(name, labels)} {value}")
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                if name not in typed:
+                    typed.add(name)
+                    lines.append(f"# TYPE {METRIC_PREFIX}{name} histogram")
+                cumulative = 0
+                for bound, count in zip([*histogram.buckets, "+Inf"], histogram.counts):
+                    cumulative += count
+                    lines.append(f"{series(name + '_bucket', labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{series(name + '_sum', labels)} {histogram.sum}")
+                lines.append(f"{series(name + '_count', labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def metrics_dir_for(download_dir):
+    return os.path.join(download_dir, METRICS_DIR)
+
+
+def write_atomic(path, text):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+def write_job_summary(download_dir, summary):
+    # Workers sharing a download directory can finish in the same second.
+    name = time.strftime("job-%Y%m%d-%H%M%S") + f"-{os.getpid()}-{os.urandom(2).hex()}.json"
+    path = os.path.join(metrics_dir_for(download_dir), name)
+    write_atomic(path, json.dumps(summary, indent=2, default=str))
+    return path
+
+
+def serve_metrics(metrics, port, host="127.0.0.1"):
+    # Prometheus scrape endpoint on a daemon thread; call shutdown() to stop.
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_with_cpu_time(func, *args):
+    # For process pool workers: returns (result, CPU seconds the call and its
+    # child processes used). Child CPU time is not reported on Windows.
+    before = os.times()
+    result = func(*args)
+    after = os.times()
+    cpu = sum(getattr(after, field) - getattr(before, field) for field in ('user', 'system', 'children_user', 'children_system'))
+    return result, cpu
+
+
+@contextmanager
+def profiled(output_dir, top=40):
+    # Runs the block under cProfile and tracemalloc and writes profile.pstats,
+    # profile.txt and memory.txt to output_dir. Threads started inside the
+    # block get their own profiler; the stats are merged at the end.
+    import cProfile
+    import io
+    import pstats
+    import tracemalloc
+
+    profilers = []
+
+    def profile_thread(*args):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ allows one active profiler, which already sees every thread.
+            return
+        profilers.append(profiler)
+
+    os.makedirs(output_dir, exist_ok=True)
+    main_profiler = cProfile.Profile()
+    tracemalloc.start(10)
+    threading.setprofile(profile_thread)
+    main_profiler.enable()
+    try:
+        yield
+    finally:
+        main_profiler.disable()
+        threading.setprofile(None)
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        stats = pstats.Stats(main_profiler)
+        for profiler in profilers:
+            try:
+                stats.add(profiler)
+            except TypeError:
+                # A thread that never made a profiled call has no stats.
+                pass
+        stats.dump_stats(os.path.join(output_dir, "profile.pstats"))
+        text = io.StringIO()
+        pstats.Stats(os.path.join(output_dir, "profile.pstats"), stream=text).sort_stats('cumulative').print_stats(top)
+        write_atomic(os.path.join(output_dir, "profile.txt"), text.getvalue())
+
+        lines = [f"Traced memory: current {current / 2 ** 20:.1f} MiB, peak {peak / 2 ** 20:.1f} MiB", ""]
+        for stat in snapshot.statistics('traceback')[:top]:
+            lines.append(f"{stat.size / 1024:.1f} KiB in {stat.count} blocks")
+            lines.extend("    " + line for line in stat.traceback.format())
+        write_atomic(os.path.join(output_dir, "memory.txt"), "\n".join(lines) + "\n")
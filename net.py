@@ -0,0 +1,49 @@
+import threading
+
+HTTP_POOL_SIZE = 16
+HTTP_RETRIES = 3
+HTTP_TIMEOUT = 30
+
+
+def create_session(pool_size=HTTP_POOL_SIZE, retries=HTTP_RETRIES, backoff_factor=0.5):
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=retries, backoff_factor=backoff_factor, status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET', 'HEAD']), respect_retry_after_header=True,
+    )
+    # pool_block keeps the number of open connections per host at pool_size
+    # instead of opening throwaway extras under load.
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry if retries else 0, pool_block=True)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class ThreadLocalYoutubeDL:
+    # One long-lived YoutubeDL per worker thread: extractor setup and the
+    # underlying HTTP connections are paid once per worker instead of per track.
+    def __init__(self, options):
+        self.options = options
+        self._local = threading.local()
+        self._instances = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        ydl = getattr(self._local, 'ydl', None)
+        if ydl is None:
+            import yt_dlp
+            ydl = yt_dlp.YoutubeDL(self.options)
+            self._local.ydl = ydl
+            with self._lock:
+                self._instances.append(ydl)
+        return ydl
+
+    def close(self):
+        with self._lock:
+            instances, self._instances = self._instances, []
+        for ydl in instances:
+            ydl.close()
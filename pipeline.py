@@ -0,0 +1,128 @@
+import queue
+import threading
+import time
+
+_END = object()
+
+
+def format_stats(stats):
+    return " | ".join(
+        f"{s['stage']}: q={s['queue_depth']} busy={s['busy']}/{s['workers']} {s['throughput']:.2f}/s"
+        for s in stats
+    )
+
+
+def first_line(reason):
+    # Failure reasons are often exceptions with multi-line messages; reports
+    # and the journal keep the first line.
+    return (str(reason).splitlines() or [''])[0]
+
+
+class Stage:
+    def __init__(self, name, func, workers=1, queue_size=None):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.queue = queue.Queue(maxsize=queue_size or self.workers * 2)
+        self.processed = 0
+        self.busy = 0
+        self.busy_seconds = 0.0
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def stats(self, elapsed):
+        with self._lock:
+            return {
+                'stage': self.name,
+                'workers': self.workers,
+                'busy': self.busy,
+                'queue_depth': self.queue.qsize(),
+                'processed': self.processed,
+                'throughput': self.processed / elapsed if elapsed > 0 else 0.0,
+                'utilization': self.busy_seconds / (elapsed * self.workers) if elapsed > 0 else 0.0,
+            }
+
+
+class Pipeline:
+    # Tasks are dicts handed from stage to stage. A stage finishes a task early
+    # by setting task['status']; it then skips the remaining stages.
+    def __init__(self, stages, is_paused=None, is_stopped=None):
+        self.stages = stages
+        self.is_paused = is_paused or threading.Event()
+        self.is_stopped = is_stopped or threading.Event()
+        self._results = queue.Queue()
+        self._started_at = None
+
+    def stats(self):
+        elapsed = time.monotonic() - self._started_at if self._started_at else 0.0
+        return [stage.stats(elapsed) for stage in self.stages]
+
+    def run(self, tasks):
+        self._started_at = time.monotonic()
+        for index, stage in enumerate(self.stages):
+            stage._running = stage.workers
+            for _ in range(stage.workers):
+                threading.Thread(target=self._work, args=(index,), daemon=True).start()
+        threading.Thread(target=self._feed, args=(tasks,), daemon=True).start()
+
+        while True:
+            task = self._results.get()
+            if task is _END:
+                return
+            yield task
+
+    def _feed(self, tasks):
+        first = self.stages[0]
+        try:
+            for task in tasks:
+                if self.is_stopped.is_set():
+                    break
+                first.queue.put(task)
+        finally:
+            for _ in range(first.workers):
+                first.queue.put(_END)
+
+    def _wait_if_paused(self):
+        while self.is_paused.is_set() and not self.is_stopped.is_set():
+            time.sleep(0.2)
+
+    def _work(self, index):
+        stage = self.stages[index]
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            task = stage.queue.get()
+            if task is _END:
+                break
+            self._wait_if_paused()
+            if not task.get('status') and self.is_stopped.is_set():
+                task['status'] = 'stopped'
+            if not task.get('status'):
+                with stage._lock:
+                    stage.busy += 1
+                started = time.monotonic()
+                try:
+                    task = stage.func(task)
+                except Exception as e:
+                    # Work cut short by a stop is not a failure of the track.
+                    task['status'] = 'stopped' if self.is_stopped.is_set() else 'failure'
+                    task['reason'] = e
+                finally:
+                    with stage._lock:
+                        stage.busy -= 1
+                        stage.processed += 1
+                        stage.busy_seconds += time.monotonic() - started
+
+            if task.get('status') or next_stage is None:
+                self._results.put(task)
+            else:
+                next_stage.queue.put(task)
+
+        with stage._lock:
+            stage._running -= 1
+            last_worker = stage._running == 0
+        if last_worker:
+            if next_stage is None:
+                self._results.put(_END)
+            else:
+                for _ in range(next_stage.workers):
+                    next_stage.queue.put(_END)
@@ -0,0 +1,154 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Spotify's documented per-request limits for the batch endpoints.
+TRACKS_BATCH_SIZE = 50
+ALBUMS_BATCH_SIZE = 20
+ALBUM_TRACKS_PAGE_SIZE = 50
+PLAYLIST_PAGE_SIZE = 100
+PLAYLIST_PREFETCH_PAGES = 4
+FETCH_WORKERS = 4
+
+
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def remaining_offsets(first_page):
+    total = first_page.get('total') or 0
+    limit = first_page.get('limit') or len(first_page['items']) or 1
+    return range(first_page.get('offset', 0) + len(first_page['items']), total, limit)
+
+
+def fetch_tracks(sp, track_ids, executor):
+    batches = executor.map(lambda ids: sp.tracks(ids)['tracks'], list(chunked(track_ids, TRACKS_BATCH_SIZE)))
+    return [track for batch in batches for track in batch]
+
+
+def fetch_albums(sp, album_ids, executor):
+    batches = executor.map(lambda ids: sp.albums(ids)['albums'], list(chunked(album_ids, ALBUMS_BATCH_SIZE)))
+    return [album for batch in batches for album in batch]
+
+
+def cached_lookup(cache, namespace, ids, fetch):
+    found = {}
+    if cache is not None:
+        cached = cache.get_many(f"{namespace}:{item_id}" for item_id in ids)
+        found = {key.split(':', 1)[1]: value for key, value in cached.items()}
+    missing = [item_id for item_id in dict.fromkeys(ids) if item_id not in found]
+    if missing:
+        fetched = fetch(missing)
+        if cache is not None:
+            cache.set_many({f"{namespace}:{item_id}": value for item_id, value in fetched.items()})
+        found.update(fetched)
+    return found
+
+
+def resolve_albums(sp, album_ids, executor=None, cache=None):
+    if executor is None:
+        with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as own_executor:
+            return resolve_albums(sp, album_ids, own_executor, cache)
+
+    def fetch_album_entries(missing):
+        albums = [album for album in fetch_albums(sp, missing, executor) if album]
+        # The extra track pages of every album are submitted from here rather
+        # than from tasks on the pool: a task waiting for pages queued behind
+        # it deadlocks once every worker is doing the same.
+        page_futures = [
+            [executor.submit(sp.album_tracks, album['id'], limit=ALBUM_TRACKS_PAGE_SIZE, offset=offset) for offset in remaining_offsets(album['tracks'])]
+            for album in albums
+        ]
+        entries = {}
+        for album, futures in zip(albums, page_futures):
+            stubs = list(album['tracks']['items'])
+            for future in futures:
+                stubs.extend(future.result()['items'])
+            album_details = {key: value for key, value in album.items() if key != 'tracks'}
+            entries[album['id']] = {'album': album_details, 'track_ids': [stub.get('id') if stub else None for stub in stubs]}
+        return entries
+
+    entries = cached_lookup(cache, 'album', album_ids, fetch_album_entries)
+    entries = [entries[album_id] for album_id in album_ids if album_id in entries]
+
+    # Collect every album's track IDs before batching so track lookups fill
+    # whole 50-ID requests across album boundaries.
+    track_ids = [track_id for entry in entries for track_id in entry['track_ids'] if track_id]
+    fetch_missing = lambda missing: {track['id']: track for track in fetch_tracks(sp, missing, executor) if track}
+    full_tracks = cached_lookup(cache, 'track', track_ids, fetch_missing)
+
+    tracks_to_process = []
+    for entry in entries:
+        for track_id in entry['track_ids']:
+            full_track = full_tracks.get(track_id)
+            tracks_to_process.append(dict(full_track, album=entry['album']) if full_track else None)
+    return tracks_to_process
+
+
+def resolve_album(sp, album_id, executor=None, cache=None):
+    return resolve_albums(sp, [album_id], executor, cache)
+
+
+def resolve_track(sp, track_id, cache=None):
+    return cached_lookup(cache, 'track', [track_id], lambda missing: {track_id: sp.track(track_id)}).get(track_id)
+
+
+def iter_pages(first_page, fetch_page, executor, prefetch=PLAYLIST_PREFETCH_PAGES):
+    # Yields pages in order while keeping at most `prefetch` requests for the
+    # following pages in flight, so a slow consumer holds back the fetching.
+    yield first_page
+    total = first_page.get('total') or 0
+    limit = first_page.get('limit') or len(first_page['items']) or 1
+    offsets = iter(range(first_page.get('offset', 0) + len(first_page['items']), total, limit))
+    pending = deque()
+    for offset in offsets:
+        pending.append(executor.submit(fetch_page, offset))
+        if len(pending) >= prefetch:
+            break
+    while pending:
+        page = pending.popleft().result()
+        offset = next(offsets, None)
+        if offset is not None:
+            pending.append(executor.submit(fetch_page, offset))
+        yield page
+
+
+def stream_playlist(sp, playlist_id, cache=None, snapshot_id=None, on_total=None):
+    # Yields the playlist's tracks one page at a time, so downloads can start
+    # after the first page instead of after the last.
+    playlist_key = None
+    if cache is not None:
+        if snapshot_id is None:
+            snapshot_id = sp.playlist(playlist_id, fields='snapshot_id')['snapshot_id']
+        playlist_key = f"playlist:{playlist_id}:{snapshot_id}"
+        entries = cache.get(playlist_key)
+        if entries is not None:
+            track_ids = [entry for entry in entries if isinstance(entry, str)]
+            cached = cache.get_many(f"track:{track_id}" for track_id in track_ids)
+            if len(cached) == len(set(track_ids)):
+                if on_total:
+                    on_total(len(entries))
+                for page in chunked(entries, PLAYLIST_PAGE_SIZE):
+                    yield [cached[f"track:{entry}"] if isinstance(entry, str) else entry for entry in page]
+                return
+
+    fetch_page = lambda offset: sp.playlist_items(playlist_id, limit=PLAYLIST_PAGE_SIZE, offset=offset, additional_types=('track',))
+    first_page = fetch_page(0)
+    if on_total:
+        on_total(first_page.get('total') or 0)
+    entries = []
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        for page in iter_pages(first_page, fetch_page, executor):
+            tracks = [item['track'] for item in page['items'] if item and item.get('track')]
+            if cache is not None:
+                cache.set_many({f"track:{track['id']}": track for track in tracks if track.get('id')})
+                # Local files have no Spotify ID, so they are stored inline.
+                entries.extend(track['id'] if track.get('id') else track for track in tracks)
+            yield tracks
+
+    if cache is not None:
+        cache.set(playlist_key, entries)
+
+
+def resolve_playlist(sp, playlist_id, cache=None, snapshot_id=None):
+    return [track for page in stream_playlist(sp, playlist_id, cache, snapshot_id) for track in page]
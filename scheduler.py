@@ -0,0 +1,219 @@
+import random
+import re
+import threading
+import time
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+DEFAULT_MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+MAX_RETRY_AFTER = 120.0
+
+
+def _status_and_headers(error):
+    # spotipy, requests and yt-dlp each carry the HTTP status and headers in
+    # different places; yt-dlp wraps the original error in exc_info.
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        response = getattr(error, 'response', None)
+        status = getattr(error, 'http_status', None) or getattr(error, 'status', None) or getattr(response, 'status_code', None) or getattr(response, 'status', None)
+        if isinstance(status, int):
+            headers = getattr(error, 'headers', None) or getattr(response, 'headers', None) or {}
+            return status, headers
+        exc_info = getattr(error, 'exc_info', None)
+        error = (exc_info[1] if exc_info else None) or error.__cause__ or error.__context__
+    return None, {}
+
+
+def parse_retry_after(value):
+    try:
+        return min(max(float(value), 0.0), MAX_RETRY_AFTER)
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(error):
+    # Returns (retryable, throttled, retry_after).
+    status, headers = _status_and_headers(error)
+    if status is None:
+        match = re.search(r"HTTP Error (\d{3})", str(error))
+        status = int(match.group(1)) if match else None
+    if status is not None:
+        retry_after = parse_retry_after(headers.get('Retry-After') if hasattr(headers, 'get') else None)
+        return status in RETRYABLE_STATUSES, status == 429, retry_after
+    if isinstance(error, (ConnectionError, TimeoutError)) or type(error).__name__ in ('ConnectionError', 'Timeout', 'ReadTimeout', 'ConnectTimeout'):
+        return True, False, None
+    return False, False, None
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    # Full jitter: spreads retries of workers that failed together.
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class TokenBucket:
+    # rate=None only enforces block(); requests are otherwise unlimited.
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate or 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, is_stopped=None):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if not self.rate:
+                    if now >= self.blocked_until:
+                        return True
+                    wait = self.blocked_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if now >= self.blocked_until and self.tokens >= 1:
+                        self.tokens -= 1
+                        return True
+                    wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            if is_stopped is not None:
+                if is_stopped.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
+
+    def block(self, seconds):
+        # A Retry-After from the upstream holds back every caller, not just
+        # the one that was told to wait.
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+class ConcurrencyLimiter:
+    # AIMD: the limit grows by one per limit-many successful calls and halves
+    # on throttling or when latency climbs well above the best seen so far.
+    def __init__(self, maximum, minimum=1, initial=None, latency_tolerance=None, cooldown=1.0):
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.limit = float(initial or self.maximum)
+        self.latency_tolerance = latency_tolerance
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.best_latency = None
+        self.last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self, is_stopped=None):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                if is_stopped is not None and is_stopped.is_set():
+                    return False
+                self._condition.wait(0.25)
+            self.in_flight += 1
+            return True
+
+    def release(self, latency=None, congested=False):
+        with self._condition:
+            self.in_flight -= 1
+            if latency is not None and not congested:
+                if self.best_latency is None or latency < self.best_latency:
+                    self.best_latency = latency
+                elif self.latency_tolerance and latency > self.best_latency * self.latency_tolerance:
+                    congested = True
+            if congested:
+                now = time.monotonic()
+                # In-flight calls that fail together count as one signal.
+                if now - self.last_decrease >= self.cooldown:
+                    self.last_decrease = now
+                    self.limit = max(self.minimum, self.limit / 2)
+            elif latency is not None:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+class Upstream:
+    # One remote service: a token bucket for its request rate, an adaptive
+    # concurrency limit, and retries with jittered exponential backoff.
+    def __init__(self, name, rate=None, burst=None, max_concurrency=4, min_concurrency=1,
+                 max_retries=DEFAULT_MAX_RETRIES, latency_tolerance=None, is_stopped=None, metrics=None):
+        self.name = name
+        self.metrics = metrics
+        self.bucket = TokenBucket(rate, burst)
+        self.limiter = ConcurrencyLimiter(max_concurrency, min_concurrency, latency_tolerance=latency_tolerance)
+        self.max_retries = max_retries
+        self.is_stopped = is_stopped or threading.Event()
+        self.calls = 0
+        self.retries = 0
+        self.throttled = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'upstream': self.name,
+                'limit': int(self.limiter.limit),
+                'in_flight': self.limiter.in_flight,
+                'calls': self.calls,
+                'retries': self.retries,
+                'throttled': self.throttled,
+                'failures': self.failures,
+            }
+
+    def call(self, func, *args, **kwargs):
+        attempt = 0
+        while True:
+            if not self.bucket.acquire(self.is_stopped):
+                raise InterruptedError("Stopped.")
+            if not self.limiter.acquire(self.is_stopped):
+                raise InterruptedError("Stopped.")
+            with self._lock:
+                self.calls += 1
+            started = time.monotonic()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                retryable, throttled, retry_after = classify_error(e)
+                self.limiter.release(congested=retryable)
+                with self._lock:
+                    self.throttled += throttled
+                    outcome = 'failure' if not retryable or attempt >= self.max_retries else 'retry'
+                    if outcome == 'failure':
+                        self.failures += 1
+                    else:
+                        self.retries += 1
+                if self.metrics is not None:
+                    self.metrics.incr('upstream_errors_total', upstream=self.name, outcome=outcome, throttled=str(bool(throttled)).lower())
+                if outcome == 'failure':
+                    raise
+                if retry_after:
+                    self.bucket.block(retry_after)
+                delay = max(retry_after or 0, backoff_delay(attempt))
+                attempt += 1
+                if self.is_stopped.wait(delay):
+                    raise
+                continue
+            latency = time.monotonic() - started
+            self.limiter.release(latency=latency)
+            if self.metrics is not None:
+                self.metrics.observe('upstream_request_seconds', latency, upstream=self.name)
+            return result
+
+
+class ScheduledClient:
+    # Routes every method call on the wrapped client (e.g. spotipy.Spotify)
+    # through an Upstream; plain attributes are passed through untouched.
+    def __init__(self, client, upstream):
+        self._client = client
+        self._upstream = upstream
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if not callable(attribute):
+            return attribute
+
+        def scheduled(*args, **kwargs):
+            return self._upstream.call(attribute, *args, **kwargs)
+        return scheduled
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import time
+
+MANIFEST_DIR = ".sync"
+
+
+def manifest_path_for(download_dir, playlist_id):
+    return os.path.join(download_dir, MANIFEST_DIR, f"{playlist_id}.json")
+
+
+def new_manifest(playlist_id):
+    return {'playlist_id': playlist_id, 'snapshot_id': None, 'synced_at': None, 'tracks': {}}
+
+
+def load_manifest(path, playlist_id):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return new_manifest(playlist_id)
+
+
+def save_manifest(path, manifest):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(temp_path, path)
+
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_entry(download_dir, path):
+    return {'path': os.path.relpath(path, download_dir), 'size': os.path.getsize(path), 'sha1': file_digest(path)}
+
+
+def relink_moved_files(download_dir, manifest):
+    # Entries whose file disappeared are matched against files of the same
+    # size by content hash, so a renamed file is not downloaded again.
+    missing = {
+        track_id: entry for track_id, entry in manifest['tracks'].items()
+        if not os.path.exists(os.path.join(download_dir, entry['path']))
+    }
+    if not missing:
+        return []
+    known_paths = {entry['path'] for entry in manifest['tracks'].values()}
+    by_size = {}
+    with os.scandir(download_dir) as entries:
+        for dir_entry in entries:
+            if dir_entry.is_file() and dir_entry.name not in known_paths:
+                by_size.setdefault(dir_entry.stat().st_size, []).append(dir_entry.path)
+
+    lost = []
+    for track_id, entry in missing.items():
+        match = next((path for path in by_size.get(entry['size'], []) if file_digest(path) == entry['sha1']), None)
+        if match:
+            entry['path'] = os.path.relpath(match, download_dir)
+            by_size[entry['size']].remove(match)
+        else:
+            del manifest['tracks'][track_id]
+            lost.append(track_id)
+    return lost
+
+
+def remove_tracks(manifest, track_ids):
+    # Returns the removed entries, keyed by track ID; see prune_files.
+    return {track_id: manifest['tracks'].pop(track_id) for track_id in track_ids if track_id in manifest['tracks']}
+
+
+def referenced_paths(download_dir, manifests):
+    # Paths listed by the given manifests and by every other manifest saved
+    # in the download directory. The given ones take precedence over their
+    # saved copies, which may be out of date.
+    loaded = {manifest['playlist_id'] for manifest in manifests}
+    paths = {entry['path'] for manifest in manifests for entry in manifest['tracks'].values()}
+    manifest_dir = os.path.join(download_dir, MANIFEST_DIR)
+    if os.path.isdir(manifest_dir):
+        for name in os.listdir(manifest_dir):
+            playlist_id, extension = os.path.splitext(name)
+            if extension == ".json" and playlist_id not in loaded:
+                saved = load_manifest(os.path.join(manifest_dir, name), playlist_id)
+                paths.update(entry['path'] for entry in saved['tracks'].values())
+    return paths
+
+
+def prune_files(download_dir, removed, manifests, keep_track_ids=()):
+    # Deletes the files of removed entries unless another playlist still
+    # lists them: the same file is shared by every playlist with the track.
+    # Tracks in keep_track_ids are about to be recorded by another playlist.
+    in_use = referenced_paths(download_dir, manifests)
+    removed_paths = []
+    for track_id, entry in removed.items():
+        path = os.path.join(download_dir, entry['path'])
+        if entry['path'] in in_use or track_id in keep_track_ids or not os.path.exists(path):
+            continue
+        os.remove(path)
+        removed_paths.append(path)
+    return removed_paths
+
+
+def mark_synced(manifest, snapshot_id):
+    manifest['snapshot_id'] = snapshot_id
+    manifest['synced_at'] = time.time()
@@ -0,0 +1,138 @@
+import base64
+import os
+
+# Spotify track ID and ISRC are written next to the regular tags so that
+# files can be matched to tracks again later (see dedup.py).
+SPOTIFY_ID_TAG = "SPOTIFY_TRACK_ID"
+MP4_FREEFORM_PREFIX = "----:com.apple.iTunes:"
+
+
+def track_fields(track_info):
+    album = track_info['album']
+    return {
+        'title': track_info['name'],
+        'artist': track_info['artists'][0]['name'],
+        'album': album['name'],
+        'year': album['release_date'].split('-')[0],
+        'track_number': track_info.get('track_number'),
+        'disc_number': track_info.get('disc_number'),
+        'isrc': (track_info.get('external_ids') or {}).get('isrc'),
+        'track_id': track_info.get('id'),
+    }
+
+
+def write_mp3_tags(path, fields, cover):
+    from mutagen.mp3 import MP3
+    from mutagen.id3 import ID3, APIC, TIT2, TPE1, TALB, TDRC, TRCK, TPOS, TSRC, TXXX
+
+    audio = MP3(path, ID3=ID3)
+    if audio.tags is None:
+        audio.add_tags()
+    if cover:
+        audio.tags.add(APIC(encoding=3, mime='image/jpeg', type=3, desc='Cover', data=cover))
+    audio.tags.add(TIT2(encoding=3, text=fields['title']))
+    audio.tags.add(TPE1(encoding=3, text=fields['artist']))
+    audio.tags.add(TALB(encoding=3, text=fields['album']))
+    audio.tags.add(TDRC(encoding=3, text=fields['year']))
+    if fields['track_number']:
+        audio.tags.add(TRCK(encoding=3, text=str(fields['track_number'])))
+    if fields['disc_number']:
+        audio.tags.add(TPOS(encoding=3, text=str(fields['disc_number'])))
+    if fields['isrc']:
+        audio.tags.add(TSRC(encoding=3, text=fields['isrc']))
+    if fields['track_id']:
+        audio.tags.add(TXXX(encoding=3, desc=SPOTIFY_ID_TAG, text=fields['track_id']))
+    audio.save()
+
+
+def write_m4a_tags(path, fields, cover):
+    from mutagen.mp4 import MP4, MP4Cover, MP4FreeForm
+
+    audio = MP4(path)
+    if audio.tags is None:
+        audio.add_tags()
+    audio.tags['\xa9nam'] = [fields['title']]
+    audio.tags['\xa9ART'] = [fields['artist']]
+    audio.tags['\xa9alb'] = [fields['album']]
+    audio.tags['\xa9day'] = [fields['year']]
+    if fields['track_number']:
+        audio.tags['trkn'] = [(fields['track_number'], 0)]
+    if fields['disc_number']:
+        audio.tags['disk'] = [(fields['disc_number'], 0)]
+    if cover:
+        audio.tags['covr'] = [MP4Cover(cover, imageformat=MP4Cover.FORMAT_JPEG)]
+    if fields['isrc']:
+        audio.tags[MP4_FREEFORM_PREFIX + 'ISRC'] = [MP4FreeForm(fields['isrc'].encode())]
+    if fields['track_id']:
+        audio.tags[MP4_FREEFORM_PREFIX + SPOTIFY_ID_TAG] = [MP4FreeForm(fields['track_id'].encode())]
+    audio.save()
+
+
+def write_opus_tags(path, fields, cover):
+    from mutagen.flac import Picture
+    from mutagen.oggopus import OggOpus
+
+    audio = OggOpus(path)
+    audio['title'] = fields['title']
+    audio['artist'] = fields['artist']
+    audio['album'] = fields['album']
+    audio['date'] = fields['year']
+    if fields['track_number']:
+        audio['tracknumber'] = str(fields['track_number'])
+    if fields['disc_number']:
+        audio['discnumber'] = str(fields['disc_number'])
+    if fields['isrc']:
+        audio['isrc'] = fields['isrc']
+    if fields['track_id']:
+        audio[SPOTIFY_ID_TAG.lower()] = fields['track_id']
+    if cover:
+        # Vorbis comments carry cover art as a base64 FLAC picture block.
+        picture = Picture()
+        picture.type = 3
+        picture.mime = 'image/jpeg'
+        picture.desc = 'Cover'
+        picture.data = cover
+        audio['metadata_block_picture'] = base64.b64encode(picture.write()).decode('ascii')
+    audio.save()
+
+
+TAG_WRITERS = {
+    '.mp3': write_mp3_tags,
+    '.m4a': write_m4a_tags,
+    '.opus': write_opus_tags,
+}
+
+
+def write_tags(path, fields, cover=None):
+    extension = os.path.splitext(path)[1].lower()
+    writer = TAG_WRITERS.get(extension)
+    if writer is None:
+        raise ValueError(f"No tag writer for {extension} files.")
+    writer(path, fields, cover)
+
+
+def read_ids(path):
+    # Returns (track_id, isrc) from the tags written above, or Nones.
+    try:
+        import mutagen
+        audio = mutagen.File(path)
+    except Exception:
+        return None, None
+    tags = getattr(audio, 'tags', None)
+    if not tags:
+        return None, None
+
+    def first(values):
+        if not values:
+            return None
+        value = values[0]
+        if hasattr(value, 'text'):
+            value = value.text[0]
+        return bytes(value).decode() if isinstance(value, bytes) else str(value)
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.mp3':
+        return first(tags.getall(f'TXXX:{SPOTIFY_ID_TAG}')), first(tags.getall('TSRC'))
+    if extension == '.m4a':
+        return first(tags.get(MP4_FREEFORM_PREFIX + SPOTIFY_ID_TAG)), first(tags.get(MP4_FREEFORM_PREFIX + 'ISRC'))
+    return first(tags.get(SPOTIFY_ID_TAG.lower())), first(tags.get('isrc'))
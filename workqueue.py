@@ -0,0 +1,364 @@
+import json
+import os
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+
+DEFAULT_LEASE_SECONDS = 300
+MAX_ATTEMPTS = 3
+POLL_INTERVAL = 2.0
+# A job whose coordinator has not renewed its input for this long is
+# assumed dead, and its input counts as closed.
+INPUT_TIMEOUT = 60
+BROKER_OPS = (
+    'push', 'lease', 'renew', 'release', 'complete', 'open_input', 'renew_input', 'close_input', 'drained', 'status', 'results', 'latest_job',
+)
+# Operations the client may send again when the connection drops before the
+# answer arrives. The others could be applied twice.
+RETRYABLE_OPS = ('renew', 'release', 'open_input', 'renew_input', 'close_input', 'drained', 'status', 'results', 'latest_job')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    position INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT UNIQUE NOT NULL, track TEXT NOT NULL, priority INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'queued', worker TEXT, lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT, updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, lease_expires);
+CREATE INDEX IF NOT EXISTS tasks_priority ON tasks (state, priority DESC, position);
+CREATE TABLE IF NOT EXISTS job_tasks (job TEXT NOT NULL, key TEXT NOT NULL, PRIMARY KEY (job, key));
+CREATE TABLE IF NOT EXISTS inputs (job TEXT PRIMARY KEY, state TEXT NOT NULL, expires REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+
+def worker_name():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def new_job_id():
+    return time.strftime("%Y%m%d-%H%M%S-") + os.urandom(3).hex()
+
+
+class SQLiteWorkQueue:
+    # Tracks shared between worker processes, possibly on several machines
+    # when the file is on a shared disk. A worker leases a track, renews the
+    # lease while it works on it and completes it with its result. Leases of
+    # workers that died expire and the track is handed out again, up to
+    # MAX_ATTEMPTS times. Network filesystems do not support WAL's shared
+    # memory, so this uses SQLite's default rollback journal. Every push
+    # belongs to a job, so several jobs can share one queue file and each
+    # coordinator reports on its own tracks only.
+    def __init__(self, path, lease_seconds=DEFAULT_LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        try:
+            # Queue files from before priorities.
+            self._conn.execute("ALTER TABLE tasks ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+        except sqlite3.OperationalError:
+            pass
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _transaction(self, func, *args):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can
+        # never lease the same row.
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(*args)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def push(self, items, priority=0, job=None):
+        # items: [{'key', 'track'}]. A track shared by several playlists or
+        # jobs is queued once, at the highest priority it was pushed with.
+        # Tracks that failed in an earlier job are queued again; finished
+        # ones keep their result. Returns the number of tracks queued.
+        now = time.time()
+
+        def insert():
+            count = "SELECT COUNT(*) FROM tasks WHERE state = 'queued'"
+            before = self._conn.execute(count).fetchone()[0]
+            self._conn.executemany(
+                "INSERT INTO tasks (key, track, priority, updated_at) VALUES (?, ?, ?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET priority = MAX(priority, excluded.priority),"
+                " attempts = CASE WHEN state = 'failed' THEN 0 ELSE attempts END,"
+                " result = CASE WHEN state = 'failed' THEN NULL ELSE result END,"
+                " updated_at = CASE WHEN state = 'failed' THEN excluded.updated_at ELSE updated_at END,"
+                " state = CASE WHEN state = 'failed' THEN 'queued' ELSE state END",
+                [(item['key'], json.dumps(item['track'], separators=(',', ':')), priority, now) for item in items],
+            )
+            if job is not None:
+                self._conn.executemany("INSERT OR IGNORE INTO job_tasks (job, key) VALUES (?, ?)", [(job, item['key']) for item in items])
+            return self._conn.execute(count).fetchone()[0] - before
+        return self._transaction(insert)
+
+    def lease(self, worker, count=1):
+        now = time.time()
+
+        def take():
+            expired = self._conn.execute(
+                "SELECT position, track FROM tasks WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, self.max_attempts),
+            ).fetchall()
+            for position, track in expired:
+                track = json.loads(track)
+                result = {
+                    'status': 'failure', 'name': (track or {}).get('name', 'Unavailable'), 'artist': ((track or {}).get('artists') or [{}])[0].get('name', ''),
+                    'reason': f"Worker lease expired {self.max_attempts} times.",
+                }
+                self._conn.execute(
+                    "UPDATE tasks SET state = 'failed', lease_expires = NULL, result = ?, updated_at = ? WHERE position = ?",
+                    (json.dumps(result), now, position),
+                )
+            rows = self._conn.execute(
+                "SELECT position, key, track FROM tasks WHERE state = 'queued' OR (state = 'leased' AND lease_expires < ?)"
+                " ORDER BY priority DESC, position LIMIT ?",
+                (now, count),
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE tasks SET state = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? WHERE position = ?",
+                [(worker, now + self.lease_seconds, now, position) for position, _, _ in rows],
+            )
+            return [{'key': key, 'track': json.loads(track)} for _, key, track in rows]
+        return self._transaction(take)
+
+    def renew(self, worker, keys):
+        now = time.time()
+
+        def extend():
+            self._conn.executemany(
+                "UPDATE tasks SET lease_expires = ?, updated_at = ? WHERE key = ? AND state = 'leased' AND worker = ?",
+                [(now + self.lease_seconds, now, key, worker) for key in keys],
+            )
+        self._transaction(extend)
+
+    def release(self, worker, keys):
+        # Hands tracks back without counting the attempt, e.g. when a worker
+        # is stopped.
+        now = time.time()
+
+        def give_back():
+            self._conn.executemany(
+                "UPDATE tasks SET state = 'queued', worker = NULL, lease_expires = NULL, attempts = MAX(attempts - 1, 0), updated_at = ?"
+                " WHERE key = ? AND state = 'leased' AND worker = ?",
+                [(now, key, worker) for key in keys],
+            )
+        self._transaction(give_back)
+
+    def complete(self, worker, key, result):
+        # False when the lease had expired and the track went to another
+        # worker; that worker's result wins.
+        state = 'done' if result.get('status') == 'success' else 'failed'
+
+        def finish():
+            cursor = self._conn.execute(
+                "UPDATE tasks SET state = ?, lease_expires = NULL, result = ?, updated_at = ? WHERE key = ? AND state = 'leased' AND worker = ?",
+                (state, json.dumps(dict(result, worker=worker), default=str), time.time(), key, worker),
+            )
+            return cursor.rowcount == 1
+        return self._transaction(finish)
+
+    def _set_input(self, job, state, latest=False):
+        def write():
+            self._conn.execute("INSERT OR REPLACE INTO inputs (job, state, expires) VALUES (?, ?, ?)", (job, state, time.time() + INPUT_TIMEOUT))
+            if latest:
+                self._conn.execute("INSERT OR REPLACE INTO meta (name, value) VALUES ('latest_job', ?)", (job,))
+        self._transaction(write)
+
+    def open_input(self, job):
+        self._set_input(job, 'open', latest=True)
+
+    def renew_input(self, job):
+        # Called by the coordinator while it is still adding tracks.
+        self._transaction(lambda: self._conn.execute(
+            "UPDATE inputs SET expires = ? WHERE job = ? AND state = 'open'", (time.time() + INPUT_TIMEOUT, job)
+        ))
+
+    def close_input(self, job):
+        # Workers exit once no job is adding tracks and nothing is left to lease.
+        self._set_input(job, 'closed')
+
+    def latest_job(self):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE name = 'latest_job'").fetchone()
+        return row[0] if row else None
+
+    def _job_filter(self, job):
+        # SQL condition and parameters restricting tasks to a job, or none.
+        if job is None:
+            return "1", ()
+        return "key IN (SELECT key FROM job_tasks WHERE job = ?)", (job,)
+
+    def drained(self, job=None):
+        # Without a job: every job's input is closed and nothing is pending.
+        # An open input that has not been renewed in time counts as closed.
+        condition, params = self._job_filter(job)
+        with self._lock:
+            if job is None:
+                inputs = self._conn.execute("SELECT state, expires FROM inputs").fetchall()
+            else:
+                inputs = self._conn.execute("SELECT state, expires FROM inputs WHERE job = ?", (job,)).fetchall()
+            pending = self._conn.execute(f"SELECT COUNT(*) FROM tasks WHERE state IN ('queued', 'leased') AND {condition}", params).fetchone()[0]
+        now = time.time()
+        still_open = any(state == 'open' and expires > now for state, expires in inputs)
+        return bool(inputs) and not still_open and not pending
+
+    def status(self, job=None):
+        condition, params = self._job_filter(job)
+        with self._lock:
+            states = dict(self._conn.execute(f"SELECT state, COUNT(*) FROM tasks WHERE {condition} GROUP BY state", params).fetchall())
+            workers = dict(self._conn.execute(
+                f"SELECT worker, COUNT(*) FROM tasks WHERE state = 'leased' AND {condition} GROUP BY worker", params
+            ).fetchall())
+        status = {state: states.get(state, 0) for state in ('queued', 'leased', 'done', 'failed')}
+        status['active_workers'] = workers
+        return status
+
+    def results(self, job=None):
+        condition, params = self._job_filter(job)
+        with self._lock:
+            rows = self._conn.execute(f"SELECT result FROM tasks WHERE state IN ('done', 'failed') AND {condition} ORDER BY position", params).fetchall()
+        return [json.loads(result) for (result,) in rows]
+
+
+class QueueBroker(socketserver.ThreadingTCPServer):
+    # Serves a SQLiteWorkQueue over TCP as JSON lines, for workers that do
+    # not share a disk with it: {"op", "args", "token"} in, {"ok", "result"}
+    # or {"ok": false, "error"} out.
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, work_queue, address, token=""):
+        self.work_queue = work_queue
+        self.token = token
+        super().__init__(address, BrokerHandler)
+
+
+class BrokerHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if self.server.token and request.get('token') != self.server.token:
+                    raise PermissionError("Invalid queue token.")
+                if request.get('op') not in BROKER_OPS:
+                    raise ValueError(f"Unknown operation: {request.get('op')}")
+                result = getattr(self.server.work_queue, request['op'])(**request.get('args', {}))
+                response = {'ok': True, 'result': result}
+            except Exception as e:
+                response = {'ok': False, 'error': str(e)}
+            self.wfile.write((json.dumps(response, default=str) + "\n").encode())
+            self.wfile.flush()
+
+
+class RemoteWorkQueue:
+    # Client for QueueBroker with the same methods as SQLiteWorkQueue.
+    def __init__(self, host, port, token="", timeout=30):
+        self.address = (host, port)
+        self.token = token
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._socket = None
+        self._file = None
+
+    def _connect(self):
+        self._socket = socket.create_connection(self.address, timeout=self.timeout)
+        self._file = self._socket.makefile('rwb')
+
+    def _disconnect(self):
+        if self._socket is not None:
+            self._file.close()
+            self._socket.close()
+        self._socket = self._file = None
+
+    def _call(self, op, **args):
+        request = (json.dumps({'op': op, 'args': args, 'token': self.token}, default=str) + "\n").encode()
+        with self._lock:
+            # One reconnect covers a broker restart between calls. Once a
+            # request was sent, only operations that are safe to apply twice
+            # are sent again.
+            for attempt in range(2):
+                sent = False
+                try:
+                    if self._socket is None:
+                        self._connect()
+                    sent = True
+                    self._file.write(request)
+                    self._file.flush()
+                    line = self._file.readline()
+                    if not line:
+                        raise ConnectionError("Queue broker closed the connection.")
+                    break
+                except OSError:
+                    self._disconnect()
+                    if attempt or (sent and op not in RETRYABLE_OPS):
+                        raise
+        response = json.loads(line)
+        if not response['ok']:
+            raise RuntimeError(f"Queue broker: {response['error']}")
+        return response['result']
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+    def push(self, items, priority=0, job=None):
+        return self._call('push', items=items, priority=priority, job=job)
+
+    def lease(self, worker, count=1):
+        return self._call('lease', worker=worker, count=count)
+
+    def renew(self, worker, keys):
+        return self._call('renew', worker=worker, keys=keys)
+
+    def release(self, worker, keys):
+        return self._call('release', worker=worker, keys=keys)
+
+    def complete(self, worker, key, result):
+        return self._call('complete', worker=worker, key=key, result=result)
+
+    def open_input(self, job):
+        return self._call('open_input', job=job)
+
+    def renew_input(self, job):
+        return self._call('renew_input', job=job)
+
+    def close_input(self, job):
+        return self._call('close_input', job=job)
+
+    def latest_job(self):
+        return self._call('latest_job')
+
+    def drained(self, job=None):
+        return self._call('drained', job=job)
+
+    def status(self, job=None):
+        return self._call('status', job=job)
+
+    def results(self, job=None):
+        return self._call('results', job=job)
+
+
+def parse_address(value, default_host="127.0.0.1"):
+    host, _, port = value.rpartition(':')
+    return host or default_host, int(port)
+
+
+def open_queue(spec, lease_seconds=DEFAULT_LEASE_SECONDS, token=""):
+    # "tcp://host:port" connects to a broker; anything else is a SQLite file.
+    if spec.startswith("tcp://"):
+        return RemoteWorkQueue(*parse_address(spec[len("tcp://"):]), token=token)
+    return SQLiteWorkQueue(spec, lease_seconds=lease_seconds)